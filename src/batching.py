@@ -0,0 +1,108 @@
+import asyncio
+from collections import Counter
+from time import time
+
+from src.embeddings_calculator import EmbeddingsCalculator
+from src.inference import InferenceQueueFull
+
+
+class EmbeddingBatcher:
+    def __init__(self, calculator: EmbeddingsCalculator, max_wait_ms: float = 5, max_batch_size: int = 32,
+                 max_queue_size: int = 1024, num_workers: int = 1):
+        """
+        Groups concurrent single-text embedding requests into one call to the model. A batch is sent when it reaches
+        max_batch_size items or when its first item has waited max_wait_ms, whichever happens first.
+        :param calculator: the calculator whose model encodes the batches
+        :param max_wait_ms: maximum time a request waits for others to join its batch
+        :param max_batch_size: maximum number of texts encoded together
+        :param max_queue_size: maximum number of requests waiting to be batched
+        :param num_workers: number of batches that can be encoded at the same time
+        """
+        self.calculator = calculator
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.num_workers = num_workers
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+
+        self.started_at = time()
+        self.total_items = 0
+        self.total_batches = 0
+        self.batch_sizes = Counter()
+
+    async def embed(self, text: str) -> list:
+        """
+        Embed one text, sharing the model call with other concurrent requests
+        :param text: the text to embed
+        :return: the embedding of the text
+        :raises InferenceQueueFull: if too many requests are already waiting
+        """
+        cached = self.calculator.cached_embedding(text)
+        if cached is not None:
+            return cached
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            raise InferenceQueueFull(f"Embedding batch queue is full ({self.max_queue_size} pending requests)")
+        return await future
+
+    def stats(self) -> dict:
+        elapsed = time() - self.started_at
+        return {"total_items": self.total_items,
+                "total_batches": self.total_batches,
+                "mean_batch_size": self.total_items / self.total_batches if self.total_batches else 0,
+                "items_per_second": self.total_items / elapsed if elapsed else 0,
+                "queued": self._queue.qsize() if self._queue else 0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items()))}
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def _start(self) -> None:
+        # the queue and the workers are bound to the running loop, so they are created on first use
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def _collect_batch(self) -> list[tuple]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self) -> None:
+        while True:
+            batch = await self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                # embed already counted the lookups of these texts, the worker only checks whether a concurrent batch
+                # cached them meanwhile
+                embeddings = await self.calculator.calculate_async(texts, wait=True, count_lookups=False)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                # the request may have been cancelled while waiting
+                if not future.done():
+                    future.set_result(embedding)
+            self.total_items += len(batch)
+            self.total_batches += 1
+            self.batch_sizes[len(batch)] += 1
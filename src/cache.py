@@ -0,0 +1,192 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Hashable
+
+import numpy as np
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: float | None = 300):
+        """
+        Thread-safe cache with a bounded number of entries, least recently used eviction and time to live.
+        :param max_size: maximum number of entries. 0 disables the cache.
+        :param ttl: seconds an entry stays valid. None means entries never expire.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable, default=None):
+        """
+        Look up an entry without counting a hit or a miss and without refreshing its position, for callers checking
+        again a key whose lookup was already counted
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                return default
+            return entry[1]
+
+    def put(self, key: Hashable, value) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Remove every entry whose key satisfies the predicate
+        :param predicate: function that receives a key and returns True if the entry must be removed
+        :return int: number of removed entries
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UnitCache:
+    def __init__(self, path: str = ":memory:"):
+        """
+        Persistent cache of the question generated for a text unit and the embedding of that question, keyed by
+        the models that produced them and the digest of the unit. Re-ingesting an edited document only sends the
+        new or changed units to the models.
+        :param path: SQLite database file. ":memory:" keeps the cache for the lifetime of the process.
+        """
+        self.path = path
+        # opened on first use: the cache is created at import, before gunicorn forks its workers with --preload, and a
+        # SQLite connection must not be used across a fork
+        self._connection: sqlite3.Connection | None = None
+        self._inherited_connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        # the connection of the parent is left unclosed, closing it would touch its files from this process
+        self._inherited_connection = self._connection
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Connection of the current process, opened if needed. Must be called with the lock held.
+        """
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS units ("
+                                     "model TEXT NOT NULL, "
+                                     "digest TEXT NOT NULL, "
+                                     "question TEXT NOT NULL, "
+                                     "vector BLOB NOT NULL, "
+                                     "PRIMARY KEY (model, digest))")
+            self._connection.commit()
+        return self._connection
+
+    def get_many(self, model: str, units: list[str]) -> dict[str, tuple[str, np.ndarray]]:
+        """
+        Look up several text units
+        :param model: identifier of the generator and embedding models
+        :param units: text units
+        :return dict: maps every cached unit to its question and its float32 embedding
+        """
+        digests = {text_digest(unit): unit for unit in units}
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            digest_list = list(digests)
+            # SQLite limits the number of variables of a statement
+            for i in range(0, len(digest_list), 500):
+                batch = digest_list[i:i + 500]
+                rows = connection.execute(
+                    f"SELECT digest, question, vector FROM units WHERE model = ? "
+                    f"AND digest IN ({', '.join('?' * len(batch))})",
+                    [model, *batch]).fetchall()
+                for digest, question, vector in rows:
+                    found[digests[digest]] = (question, np.frombuffer(vector, dtype=np.float32))
+            self.hits += len(found)
+            self.misses += len(digests) - len(found)
+        return found
+
+    def put_many(self, model: str, questions: list[str], vectors: np.ndarray, units: list[str]) -> None:
+        """
+        Store the output of EmbeddingsCalculator.get_questions_embeddings_array
+        :param model: identifier of the generator and embedding models
+        :param questions: generated questions
+        :param vectors: matrix of the embeddings of the questions
+        :param units: text units the questions were generated from
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = [(model, text_digest(unit), question, vector.tobytes())
+                for question, vector, unit in zip(questions, vectors, units)]
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?)", rows)
+            connection.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._connect().execute("SELECT COUNT(*) FROM units").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {"size": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
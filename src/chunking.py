@@ -0,0 +1,101 @@
+import re
+from typing import Iterable
+
+"""
+Sentence ends: terminal punctuation, optionally followed by closing quotes or brackets, and whitespace
+"""
+SENTENCE_END = re.compile(r"(?:(?<=[.!?…。！？])|(?<=[.!?…。！？][\"'”’)\]]))\s+")
+
+
+def split_sentences(text: str) -> list[str]:
+    return [sentence for sentence in (part.strip() for part in SENTENCE_END.split(text)) if sentence]
+
+
+class TextChunker:
+    def __init__(self, tokenizer, max_tokens: int = 128, overlap_tokens: int = 16, min_tokens: int = 32):
+        """
+        Packs the text units extracted by the cleaners into chunks sized for the embedding model. Units are split in
+        sentences, and consecutive sentences are packed while they fit in max_tokens, so short lines are merged and
+        long blocks are split instead of being truncated by the model. A chunk is closed at the end of a unit once it
+        has min_tokens, so chunks follow the paragraphs of the source when they can. When a chunk has to be closed in
+        the middle of a unit, the next one starts with the last sentences of the previous one, up to overlap_tokens.
+        :param tokenizer: tokenizer of the embedding model, a Hugging Face tokenizer. It must not be the instance
+        used by the model, which calls it with truncation from other threads.
+        :param max_tokens: maximum tokens of a chunk, special tokens of the model included
+        :param overlap_tokens: maximum tokens repeated between two chunks of the same unit
+        :param min_tokens: chunks smaller than this are merged with the next unit
+        """
+        self.tokenizer = tokenizer
+        # room for the special tokens added by the model, such as <s> and </s>
+        self.budget = max_tokens - tokenizer.num_special_tokens_to_add()
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+
+    def count_tokens(self, texts: list[str]) -> list[int]:
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def split_long_sentence(self, sentence: str) -> list[tuple[str, int]]:
+        """
+        Cut a sentence that does not fit in a chunk at word boundaries
+        :return list[tuple]: pieces of the sentence and their number of tokens
+        """
+        words = sentence.split()
+        pieces = []
+        piece, piece_tokens = [], 0
+        for word, word_tokens in zip(words, self.count_tokens(words)):
+            if piece and piece_tokens + word_tokens > self.budget:
+                pieces.append((" ".join(piece), piece_tokens))
+                piece, piece_tokens = [], 0
+            piece.append(word)
+            piece_tokens += word_tokens
+        if piece:
+            pieces.append((" ".join(piece), piece_tokens))
+        return pieces
+
+    def chunk(self, text_units: Iterable[str]) -> list[str]:
+        """
+        :param text_units: lines or blocks of text, in document order
+        :return chunks: the packed text, in document order
+        """
+        units = [split_sentences(unit) for unit in text_units]
+        counts = iter(self.count_tokens([sentence for sentences in units for sentence in sentences]))
+
+        chunks = []
+        # sentences of the chunk being packed and their tokens. Joining them can add or merge a token at every
+        # boundary, so the sum is an estimate and every join is counted as one more token.
+        current: list[tuple[str, int]] = []
+        current_tokens = 0
+
+        def close(overlap: bool) -> None:
+            nonlocal current, current_tokens
+            chunks.append(" ".join(sentence for sentence, _ in current))
+            kept = []
+            if overlap:
+                kept_tokens = 0
+                for sentence, tokens in reversed(current[1:]):
+                    if kept_tokens + tokens + 1 > self.overlap_tokens:
+                        break
+                    kept.insert(0, (sentence, tokens))
+                    kept_tokens += tokens + 1
+            current = kept
+            current_tokens = sum(tokens + 1 for _, tokens in kept)
+
+        for sentences in units:
+            for sentence in sentences:
+                tokens = next(counts)
+                pieces = [(sentence, tokens)] if tokens <= self.budget else self.split_long_sentence(sentence)
+                for piece, piece_tokens in pieces:
+                    if current and current_tokens + piece_tokens > self.budget:
+                        close(overlap=True)
+                        if current and current_tokens + piece_tokens > self.budget:
+                            current, current_tokens = [], 0
+                    current.append((piece, piece_tokens))
+                    current_tokens += piece_tokens + 1
+            if current and current_tokens >= self.min_tokens:
+                close(overlap=False)
+        if current:
+            close(overlap=False)
+        return chunks
+
@@ -1,21 +1,143 @@
-from sentence_transformers import SentenceTransformer
-from time import time
+from time import time, perf_counter
 import logging
 
+import numpy as np
+
+from src.cache import LRUCache
+from src.inference import InferenceExecutor, LazyModel
 from src.text_scraping import HtmlCleaner, PyMuPdfCleaner
 
 
 class EmbeddingsCalculator:
-    def __init__(self, model_name="paraphrase-multilingual-MiniLM-L12-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name="paraphrase-multilingual-MiniLM-L12-v2", executor: InferenceExecutor | None = None,
+                 cache: LRUCache | None = None, dtype: str = "float32", backend: str = "torch",
+                 num_threads: int | None = None, quantize: bool = True):
+        """
+        :param model_name: name of the SentenceTransformer model
+        :param executor: executor where the async methods run the model
+        :param cache: cache of query embeddings
+        :param dtype: type of the arrays returned by the array methods: "float32", "float16" or "int8". int8
+        vectors are scaled per row, which keeps their cosine similarity.
+        :param backend: "torch" runs the SentenceTransformer model, "onnx" runs it with ONNX Runtime
+        :param num_threads: intra-op threads of the ONNX backend
+        :param quantize: use the dynamically int8 quantized model in the ONNX backend
+        """
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported embeddings dtype: {dtype}")
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unsupported inference backend: {backend}")
+        self.dtype = dtype
+        self.backend = backend
+        self.model_name = model_name
+        # identifies the outputs of the model in persistent caches, quantized models give slightly different ones
+        self.model_id = model_name if backend == "torch" else f"{model_name}@onnx{'-int8' if quantize else ''}"
+        self.num_threads = num_threads
+        self.quantize = quantize
+        # the model is loaded on first use or by warm_up, so creating a calculator is cheap
+        self._model = LazyModel(self.model_id, self._load_model)
+        self.warm_up_seconds = None
+        self.executor = executor or InferenceExecutor(name="embeddings")
+        self.cache = cache if cache is not None else LRUCache(max_size=4096, ttl=3600)
+
+    def _load_model(self):
+        if self.backend == "onnx":
+            from src.onnx_backend import OnnxSentenceEncoder
+
+            return OnnxSentenceEncoder(self.model_name, num_threads=self.num_threads, quantize=self.quantize)
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(self.model_name)
+
+    @property
+    def model(self):
+        return self._model.get()
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    def load_tokenizer(self):
+        """
+        New instance of the tokenizer of the model. Fast tokenizers change their truncation settings on every call
+        that uses different ones, so code running next to the model must not share its instance.
+        """
+        from transformers import AutoTokenizer
+
+        model_id = self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+        return AutoTokenizer.from_pretrained(model_id)
+
+    @property
+    def max_seq_length(self) -> int:
+        """
+        Tokens of a text seen by the model, longer texts are truncated
+        """
+        return self.model.max_seq_length
+
+    @property
+    def loaded(self) -> bool:
+        return self._model.loaded
+
+    def load(self) -> None:
+        """
+        Load the model without running it. Used to load the weights once before forking worker processes.
+        """
+        self._model.get()
+
+    def warm_up(self) -> None:
+        """
+        Load the model and run one encode, so the first request does not pay for it
+        """
+        start = perf_counter()
+        self.model.encode(["warm up"])
+        self.warm_up_seconds = perf_counter() - start
+
+    def status(self) -> dict:
+        return {"model": self.model_id,
+                "loaded": self.loaded,
+                "load_seconds": self._model.load_seconds,
+                "warm_up_seconds": self.warm_up_seconds}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split())
 
-    def calculate(self, text_unit: str | list[str]) -> list:
+    def cached_embedding(self, text: str) -> list | None:
+        return self.cache.get(self.normalize(text))
+
+    def calculate(self, text_unit: str | list[str], use_cache: bool = True, count_lookups: bool = True) -> list:
         """
         Calculate embeddings using the model
         :param text_unit: the unit or list of units of text to embed.
+        :param use_cache: look up and store the embeddings in the query cache. Only texts missing from the cache are
+        sent to the model.
+        :param count_lookups: count the cache lookups in the hit and miss statistics. False when the caller already
+        looked the texts up with cached_embedding.
         :return:
         """
-        return self.model.encode(text_unit).tolist()
+        if not use_cache:
+            return self.model.encode(text_unit).tolist()
+
+        texts = [text_unit] if isinstance(text_unit, str) else text_unit
+        keys = [self.normalize(text) for text in texts]
+        lookup = self.cache.get if count_lookups else self.cache.peek
+        embeddings = [lookup(key) for key in keys]
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self.model.encode([texts[idx] for idx in missing]).tolist()
+            for idx, embedding in zip(missing, computed):
+                embeddings[idx] = embedding
+                self.cache.put(keys[idx], embedding)
+        return embeddings[0] if isinstance(text_unit, str) else embeddings
+
+    async def calculate_async(self, text_unit: str | list[str], wait: bool = False, count_lookups: bool = True) -> list:
+        """
+        Calculate embeddings in the inference executor, without blocking the event loop
+        :param text_unit: the unit or list of units of text to embed.
+        :param wait: wait for a free slot instead of raising InferenceQueueFull when the queue is full.
+        :param count_lookups: see calculate
+        :return:
+        """
+        return await self.executor.run(self.calculate, text_unit, count_lookups=count_lookups, wait=wait)
 
     def get_questions_embeddings(self, questions: list[str], answers: list[str]) -> list[tuple]:
         """
@@ -25,9 +147,43 @@ class EmbeddingsCalculator:
         :param questions:
         :return list[tuple]: pairs of lines and their embeddings.
         """
-        questions_embeddings = self.calculate(questions)
+        # generated questions are not repeated queries, keep them out of the cache
+        questions_embeddings = self.calculate(questions, use_cache=False)
         return list(zip(questions, questions_embeddings, answers))
 
+    async def get_questions_embeddings_async(self, questions: list[str], answers: list[str],
+                                             wait: bool = True) -> list[tuple]:
+        return await self.executor.run(self.get_questions_embeddings, questions, answers, wait=wait)
+
+    def calculate_array(self, text_units: list[str]) -> np.ndarray:
+        """
+        Calculate embeddings as one contiguous matrix, without converting them to Python floats
+        :param text_units: the units of text to embed.
+        :return np.ndarray: matrix of shape (len(text_units), dimension) with the dtype of the calculator
+        """
+        embeddings = self.model.encode(text_units, convert_to_numpy=True)
+        if self.dtype == "int8":
+            scale = np.abs(embeddings).max(axis=1, keepdims=True)
+            scale[scale == 0] = 1
+            return np.ascontiguousarray(np.rint(embeddings / scale * 127).astype(np.int8))
+        return np.ascontiguousarray(embeddings, dtype=self.dtype)
+
+    async def calculate_array_async(self, text_units: list[str], wait: bool = True) -> np.ndarray:
+        return await self.executor.run(self.calculate_array, text_units, wait=wait)
+
+    def get_questions_embeddings_array(self, questions: list[str], answers: list[str]) -> tuple:
+        """
+        Array version of get_questions_embeddings.
+        :param answers:
+        :param questions:
+        :return tuple: the questions, the matrix of their embeddings and the answers
+        """
+        return questions, self.calculate_array(questions), answers
+
+    async def get_questions_embeddings_array_async(self, questions: list[str], answers: list[str],
+                                                   wait: bool = True) -> tuple:
+        return await self.executor.run(self.get_questions_embeddings_array, questions, answers, wait=wait)
+
 
 def html_test():
     logging.basicConfig(level=logging.DEBUG)
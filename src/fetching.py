@@ -0,0 +1,117 @@
+import asyncio
+from dataclasses import dataclass
+from time import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+import httpx
+
+from src.cache import LRUCache
+
+
+class FetchError(Exception):
+    """
+    Raised when a page cannot be downloaded: network errors, timeouts, error status codes and bodies over the size cap.
+    """
+
+
+@dataclass
+class FetchResult:
+    url: str
+    content: object
+    status_code: int
+    not_modified: bool
+    elapsed: float
+
+
+class PageFetcher:
+    def __init__(self, parse: Callable[[str], object] | None = None, timeout: float = 10, max_bytes: int = 5 * 2 ** 20,
+                 max_connections: int = 64, max_per_host: int = 4, cache: LRUCache | None = None,
+                 user_agent: str = "Mozilla/5.0 (compatible; question-search)"):
+        """
+        Downloads pages with one pooled HTTP client shared by every request. Responses are cached with their ETag
+        and Last-Modified headers, so fetching an unchanged page again costs a 304 round trip and no parsing.
+        :param parse: applied to the text of every downloaded page in a worker thread. The cache stores its result.
+        :param timeout: seconds allowed to connect, and between two reads of the body
+        :param max_bytes: pages with bigger bodies raise FetchError
+        :param max_connections: connections open at the same time, across all hosts
+        :param max_per_host: requests in flight to the same host
+        :param cache: conditional-GET cache, keyed by URL
+        :param user_agent: User-Agent header sent with the requests
+        """
+        self.parse = parse
+        self.max_bytes = max_bytes
+        self.max_per_host = max_per_host
+        self.cache = cache if cache is not None else LRUCache(max_size=1024, ttl=None)
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(timeout),
+                                        limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections),
+                                        headers={"User-Agent": user_agent},
+                                        follow_redirects=True)
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+        self.requests = 0
+        self.not_modified = 0
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_limits[host]
+
+    async def fetch(self, url: str) -> FetchResult:
+        """
+        Download a page, or revalidate the cached copy of it
+        :param url: address of the page
+        :return FetchResult: the parsed content of the page, and whether it came from the cache after a 304
+        :raises FetchError: if the page could not be downloaded
+        """
+        cached = self.cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        start = time()
+        async with self._host_limit(url):
+            self.requests += 1
+            try:
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and cached is not None:
+                        self.not_modified += 1
+                        return FetchResult(url, cached["content"], 304, True, time() - start)
+                    if response.status_code >= 400:
+                        raise FetchError(f"{url} returned HTTP {response.status_code}")
+                    body = await self._read_body(url, response)
+                    encoding = response.encoding or "utf-8"
+            except httpx.HTTPError as e:
+                raise FetchError(f"Could not fetch {url}: {e!r}") from e
+
+        text = body.decode(encoding, errors="replace")
+        content = await asyncio.to_thread(self.parse, text) if self.parse else text
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.cache.put(url, {"etag": etag, "last_modified": last_modified, "content": content})
+        return FetchResult(url, content, response.status_code, False, time() - start)
+
+    async def _read_body(self, url: str, response: httpx.Response) -> bytes:
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise FetchError(f"{url} is {content_length} bytes, the limit is {self.max_bytes}")
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise FetchError(f"{url} is bigger than the limit of {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests,
+                "not_modified": self.not_modified,
+                "cache": self.cache.stats()}
+
+    async def close(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration of the production serving mode:
+
+    gunicorn src.main:app -c src/gunicorn_conf.py
+
+The application, including the weights of both models, is imported once in the master process and the workers are
+forked from it, so they share the model memory copy-on-write instead of loading one copy each. Ingestion state lives
+in the memory of each worker, so with more than one worker only the query endpoints are served.
+"""
+import gc
+import os
+
+# must be set before the application is imported by the master
+os.environ.setdefault("PRELOAD_MODELS", "true")
+
+bind = os.getenv("BIND", "0.0.0.0:80")
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", 120))
+torch_threads = int(os.getenv("TORCH_THREADS_PER_WORKER", 0))
+
+
+def when_ready(server):
+    # move the objects created while loading the models out of the garbage collector generations, so collections
+    # in the workers do not write to their pages and copy them
+    gc.freeze()
+    server.log.info(f"Models loaded in the master process, forking {workers} workers")
+
+
+def post_fork(server, worker):
+    if torch_threads:
+        import torch
+
+        torch.set_num_threads(torch_threads)
+    server.log.info(f"Worker {worker.pid} started")
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+from typing import Callable
+
+
+class InferenceQueueFull(Exception):
+    pass
+
+
+class InferenceExecutor:
+    def __init__(self, max_workers: int = 1, max_queue_size: int = 64, name: str = "inference"):
+        """
+        Runs blocking model inference in a pool of threads, outside the event loop. At most max_workers calls run at
+        the same time and at most max_queue_size calls wait for a free worker; beyond that new calls are rejected
+        instead of piling up.
+        :param max_workers: number of inference threads
+        :param max_queue_size: number of calls allowed to wait for a worker
+        :param name: prefix of the thread names
+        """
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(max_workers + max_queue_size)
+
+    async def run(self, func, *args, wait: bool = False, **kwargs):
+        """
+        Run func(*args, **kwargs) in the pool and await its result.
+        :param func: blocking callable, usually a model forward pass
+        :param wait: if True, wait for a free slot when the queue is full instead of raising
+        :return: the value returned by func
+        :raises InferenceQueueFull: if the queue is full and wait is False
+        """
+        if self._slots.locked() and not wait:
+            raise InferenceQueueFull(f"Inference queue is full ({self.max_queue_size} pending calls)")
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LazyModel:
+    def __init__(self, name: str, loader: Callable):
+        """
+        Loads a model the first time it is needed. Concurrent callers wait for a single load.
+        :param name: name reported in logs and status
+        :param loader: function without arguments that returns the loaded model
+        """
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = perf_counter()
+                    self._value = self._loader()
+                    self.load_seconds = perf_counter() - start
+                    logging.info(f"Loaded {self.name} in {self.load_seconds:.2f} seconds")
+        return self._value
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
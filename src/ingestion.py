@@ -0,0 +1,324 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Coroutine
+
+"""
+How the text units of a collection are indexed. "generated-question" embeds a question generated from every unit,
+"direct-passage" embeds the units themselves without running the generator and "hybrid" stores both vectors in every
+point, as named vectors.
+"""
+INDEXING_STRATEGIES = {
+    "generated-question": ("question",),
+    "direct-passage": ("passage",),
+    "hybrid": ("question", "passage"),
+}
+
+
+def content_digest(text_units: list[str]) -> str:
+    """
+    Stable digest of the cleaned text units of a document. Unlike hash(), it does not change between processes.
+    Every unit is prefixed with its length so that different splits of the same text produce different digests.
+    :param text_units: lines or blocks of text extracted from the source
+    :return str: hexadecimal SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    for unit in text_units:
+        encoded = unit.encode("utf-8")
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def collection_key(text_units: list[str], strategy: str = "generated-question") -> str:
+    """
+    Digest identifying the collection of a document indexed with a strategy. The same content indexed with different
+    strategies lives in different collections.
+    """
+    digest = content_digest(text_units)
+    if strategy == "generated-question":
+        return digest
+    return hashlib.sha256(f"{strategy}:{digest}".encode("utf-8")).hexdigest()
+
+
+class IngestionIndex:
+    def __init__(self, path: str | None = None):
+        """
+        Maps the digest of a document's content to the collection that holds its vectors, so identical content is
+        only ingested once no matter who submits it or under which name.
+        :param path: optional JSON file where the index is persisted. Entries of ingestions interrupted by a
+        restart are discarded when it is loaded.
+        """
+        self.path = Path(path) if path else None
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+            self.entries = {digest: entry for digest, entry in entries.items() if entry["status"] == "ready"}
+
+    def get(self, digest: str) -> dict | None:
+        return self.entries.get(digest)
+
+    def start(self, digest: str, collection_id: str, source_name: str, total_units: int, username: str,
+              strategy: str = "generated-question") -> dict:
+        with self._lock:
+            self.entries[digest] = {"collection_id": collection_id,
+                                    "strategy": strategy,
+                                    "status": "ingesting",
+                                    "total_units": total_units,
+                                    "total_vectors": 0,
+                                    "sources": [source_name],
+                                    "owners": {username: [source_name]}}
+            self._save()
+            return self.entries[digest]
+
+    def complete(self, digest: str, total_vectors: int) -> list[dict]:
+        """
+        Mark an ingestion as ready. Its sources stop pointing to the content they had before, see release_source.
+        :return list[dict]: entries left without sources, removed from the index
+        """
+        with self._lock:
+            entry = self.entries[digest]
+            entry["status"] = "ready"
+            entry["total_vectors"] = total_vectors
+            dropped = []
+            for username, sources in list(entry.get("owners", {}).items()):
+                for source_name in list(sources):
+                    dropped.extend(self._release(digest, source_name, username))
+            self._save()
+            return dropped
+
+    def find_source(self, source_name: str, strategy: str = "generated-question") -> str | None:
+        """
+        Digest of the content last ingested for a source with an indexing strategy. While new content of the source
+        is being ingested, the ready entry of the previous one is returned.
+        """
+        found = None
+        for digest, entry in list(self.entries.items()):
+            if source_name in entry["sources"] and entry.get("strategy", "generated-question") == strategy:
+                if entry["status"] == "ready":
+                    return digest
+                found = found or digest
+        return found
+
+    def collection_in_use(self, collection_id: str) -> bool:
+        """
+        Whether an entry holds its vectors in the collection. Collections are named after the digest of the content
+        they were created for, which an entry of other content may still use if the index was written by a version
+        that updated collections in place.
+        """
+        return any(entry["collection_id"] == collection_id for entry in list(self.entries.values()))
+
+    def release_source(self, digest: str, source_name: str, username: str) -> list[dict]:
+        """
+        Remove a source of a user from the entries of its other contents with the same strategy, once the entry of
+        digest holds it. Entries left without sources are removed, the caller deletes their collections.
+        :return list[dict]: the removed entries
+        """
+        with self._lock:
+            dropped = self._release(digest, source_name, username)
+            self._save()
+            return dropped
+
+    def _release(self, digest: str, source_name: str, username: str) -> list[dict]:
+        current = self.entries[digest]
+        strategy = current.get("strategy", "generated-question")
+        dropped = []
+        for other_digest, entry in list(self.entries.items()):
+            if (other_digest == digest or source_name not in entry["sources"]
+                    or entry.get("strategy", "generated-question") != strategy):
+                continue
+            owners = entry.setdefault("owners", {})
+            if source_name in owners.get(username, []):
+                owners[username].remove(source_name)
+                if not owners[username]:
+                    del owners[username]
+            if not any(source_name in sources for sources in owners.values()):
+                entry["sources"].remove(source_name)
+            # an ingesting entry is completed or aborted by its own job
+            if (not entry["sources"] and entry["status"] == "ready"
+                    and entry["collection_id"] != current["collection_id"]):
+                dropped.append(self.entries.pop(other_digest))
+        return dropped
+
+    def add_source(self, digest: str, source_name: str, username: str) -> None:
+        with self._lock:
+            entry = self.entries[digest]
+            if source_name not in entry["sources"]:
+                entry["sources"].append(source_name)
+            user_sources = entry.setdefault("owners", {}).setdefault(username, [])
+            if source_name not in user_sources:
+                user_sources.append(source_name)
+            self._save()
+
+    def user_collections(self, username: str) -> dict[str, list[str]]:
+        """
+        Collections holding the documents submitted by a user
+        :return dict: maps every collection_id to the sources of the user stored in it
+        """
+        return {entry["collection_id"]: list(entry["owners"][username])
+                for entry in list(self.entries.values()) if username in entry.get("owners", {})}
+
+    def remove(self, digest: str) -> None:
+        with self._lock:
+            self.entries.pop(digest, None)
+            self._save()
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        tmp_path.replace(self.path)
+
+
+class IngestionJob:
+    def __init__(self, username: str, source_name: str, collection_id: str | None = None,
+                 batch_id: str | None = None):
+        self.id = uuid.uuid4().hex
+        self.batch_id = batch_id
+        self.username = username
+        self.collection_id = collection_id
+        self.source_name = source_name
+        self.status = "pending"
+        self.processed = 0
+        self.total = 0
+        self.deduplicated = False
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    def advance(self, units: int) -> None:
+        self.processed += units
+
+    def to_dict(self) -> dict:
+        return {"job_id": self.id,
+                "batch_id": self.batch_id,
+                "collection_id": self.collection_id,
+                "source_name": self.source_name,
+                "status": self.status,
+                "processed": self.processed,
+                "total": self.total,
+                "deduplicated": self.deduplicated,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at}
+
+
+class IngestionBatch:
+    def __init__(self, size: int, store: Callable[[list[tuple]], Awaitable[list]]):
+        """
+        Gathers the text units of the jobs of a bulk submission and stores all of them with a single call, so the
+        documents share the batches sent to the models instead of paying for them one by one.
+        :param size: number of jobs in the batch. Every job must call either store or skip exactly once.
+        :param store: async function that receives the documents of the jobs that called store and returns one
+        result per document, in the same order
+        """
+        self.id = uuid.uuid4().hex
+        self.expected = size
+        self._store = store
+        self._documents: list[tuple] = []
+        self._futures: list[asyncio.Future] = []
+        self._task = None
+
+    async def store(self, document: tuple):
+        """
+        Wait until every job of the batch is ready, then store the documents together
+        :param document: arguments describing the document, passed to the store function
+        :return: the result of the store function for this document
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._documents.append(document)
+        self._futures.append(future)
+        self._maybe_start()
+        return await future
+
+    def skip(self) -> None:
+        """
+        Called by jobs that will not store anything: deduplicated documents and failures before storing
+        """
+        self.expected -= 1
+        self._maybe_start()
+
+    def _maybe_start(self) -> None:
+        if self._task is None and self._documents and len(self._documents) == self.expected:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            results = await self._store(self._documents)
+        except Exception as e:
+            for future in self._futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(self._futures, results):
+            future.set_result(result)
+
+
+class JobManager:
+    def __init__(self, max_workers: int = 2):
+        """
+        Keeps track of ingestion jobs and runs their blocking work in a pool of worker threads, so the event loop
+        stays free to serve other requests.
+        :param max_workers: number of threads available for scraping, question generation and embedding.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self.jobs: dict[str, IngestionJob] = {}
+        self._tasks = set()
+
+    def create_job(self, username: str, source_name: str, collection_id: str | None = None,
+                   batch_id: str | None = None) -> IngestionJob:
+        job = IngestionJob(username, source_name, collection_id, batch_id)
+        self.jobs[job.id] = job
+        return job
+
+    def submit(self, job: IngestionJob, coroutine: Coroutine) -> IngestionJob:
+        """
+        Schedule the coroutine that performs the ingestion of a job. It returns immediately.
+        :param job: the job being tracked
+        :param coroutine: the ingestion work. Its return value is stored as the job result.
+        :return job:
+        """
+        task = asyncio.create_task(self._run(job, coroutine))
+        # keep a reference so the task is not garbage collected before finishing
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """
+        Run a blocking function in the worker pool and wait for its result without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def get_job(self, job_id: str) -> IngestionJob | None:
+        return self.jobs.get(job_id)
+
+    def get_user_jobs(self, username: str, batch_id: str | None = None) -> list[IngestionJob]:
+        return [job for job in self.jobs.values()
+                if job.username == username and (batch_id is None or job.batch_id == batch_id)]
+
+    @staticmethod
+    async def _run(job: IngestionJob, coroutine: Coroutine) -> None:
+        job.status = "running"
+        try:
+            job.result = await coroutine
+            job.status = "completed"
+        except Exception as e:
+            logging.exception(f"Ingestion job {job.id} failed")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.utcnow()
@@ -1,23 +1,45 @@
+from time import perf_counter
+
+IMPORT_STARTED = perf_counter()
+
+import asyncio
+import heapq
+import logging
 import re
 import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from os import getenv
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Callable
 from inspect import signature
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, HttpUrl, EmailStr
-from src.text_scraping import HtmlCleaner, PyMuPdfCleaner, get_readable_html
+from pydantic import BaseModel, HttpUrl, EmailStr, Field
+from src.text_scraping import HtmlCleaner, PyMuPdfCleaner, readable_content, pdf_extraction_pool
+from src.fetching import PageFetcher
 from src.embeddings_calculator import EmbeddingsCalculator
 from src.question_generator import QuestionGeneratorTransformers
-from src.vector_db import VectorDB
+from src.vector_db import VectorDB, INDEX_PROFILES
+from src.ingestion import (JobManager, IngestionJob, IngestionIndex, IngestionBatch, INDEXING_STRATEGIES,
+                           collection_key)
+from src.inference import InferenceExecutor, InferenceQueueFull, LazyModel
+from src.batching import EmbeddingBatcher
+from src.pipeline import run_stages
+from src.cache import LRUCache, UnitCache
+from src.chunking import TextChunker
+from src.sparse_index import SparseIndexStore, reciprocal_rank_fusion
 from urllib.parse import unquote
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from dotenv import load_dotenv
+import numpy as np
+
+IMPORT_SECONDS = perf_counter() - IMPORT_STARTED
 
 load_dotenv(dotenv_path=Path("../.env"))
 ACCESS_TOKEN_SECRET_KEY = getenv("ACCESS_TOKEN_SECRET_KEY")
@@ -25,6 +47,53 @@ REFRESH_TOKEN_SECRET_KEY = getenv("REFRESH_TOKEN_SECRET_KEY")
 ALGORITHM = getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 REFRESH_TOKEN_EXPIRE_DAYS = int(getenv("REFRESH_TOKEN_EXPIRE_DAYS"))
+INGESTION_WORKERS = int(getenv("INGESTION_WORKERS", 2))
+INGESTION_CHUNK_SIZE = int(getenv("INGESTION_CHUNK_SIZE", 64))
+INGESTION_QUEUE_SIZE = int(getenv("INGESTION_QUEUE_SIZE", 2))
+EMBEDDING_WORKERS = int(getenv("EMBEDDING_WORKERS", 2))
+EMBEDDING_QUEUE_SIZE = int(getenv("EMBEDDING_QUEUE_SIZE", 128))
+EMBEDDING_BATCH_WAIT_MS = float(getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+EMBEDDING_BATCH_SIZE = int(getenv("EMBEDDING_BATCH_SIZE", 32))
+PRELOAD_MODELS = getenv("PRELOAD_MODELS", "false").lower() in ("1", "true", "yes")
+# read by both gunicorn and uvicorn as the number of worker processes
+SERVER_WORKERS = int(getenv("WEB_CONCURRENCY", 1))
+MODEL_WARMUP = getenv("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+INFERENCE_BACKEND = getenv("INFERENCE_BACKEND", "torch")
+ONNX_THREADS = int(getenv("ONNX_THREADS", 0)) or None
+ONNX_QUANTIZE = getenv("ONNX_QUANTIZE", "true").lower() in ("1", "true", "yes")
+EMBEDDING_DTYPE = getenv("EMBEDDING_DTYPE", "float32")
+EMBEDDING_CACHE_SIZE = int(getenv("EMBEDDING_CACHE_SIZE", 4096))
+EMBEDDING_CACHE_TTL = float(getenv("EMBEDDING_CACHE_TTL", 3600))
+QDRANT_STORAGE = getenv("QDRANT_STORAGE", ":memory:")
+QDRANT_API_KEY = getenv("QDRANT_API_KEY")
+COLLECTION_PROFILE = getenv("COLLECTION_PROFILE", "full")
+INDEXING_STRATEGY = getenv("INDEXING_STRATEGY", "generated-question")
+INDEX_PROFILE = getenv("INDEX_PROFILE", "balanced")
+LIBRARY_SEARCH_CONCURRENCY = int(getenv("LIBRARY_SEARCH_CONCURRENCY", 16))
+QDRANT_UPSERT_BATCH_SIZE = int(getenv("QDRANT_UPSERT_BATCH_SIZE", 256))
+QDRANT_UPSERT_PARALLEL = int(getenv("QDRANT_UPSERT_PARALLEL", 1))
+RETRIEVAL_MODE = getenv("RETRIEVAL_MODE", "dense")
+SPARSE_INDEX_PATH = getenv("SPARSE_INDEX_PATH")
+HYBRID_CANDIDATES = int(getenv("HYBRID_CANDIDATES", 20))
+RRF_K = int(getenv("RRF_K", 60))
+TEXT_CHUNKING = getenv("TEXT_CHUNKING", "true").lower() in ("1", "true", "yes")
+CHUNK_MAX_TOKENS = int(getenv("CHUNK_MAX_TOKENS", 128))
+CHUNK_OVERLAP_TOKENS = int(getenv("CHUNK_OVERLAP_TOKENS", 16))
+CHUNK_MIN_TOKENS = int(getenv("CHUNK_MIN_TOKENS", 32))
+BULK_INGESTION_MAX_URLS = int(getenv("BULK_INGESTION_MAX_URLS", 100))
+HTML_STREAMING_CLEANER = getenv("HTML_STREAMING_CLEANER", "true").lower() in ("1", "true", "yes")
+PDF_EXTRACTION_WORKERS = int(getenv("PDF_EXTRACTION_WORKERS", 1))
+INGESTION_INDEX_PATH = getenv("INGESTION_INDEX_PATH")
+UNIT_CACHE_PATH = getenv("UNIT_CACHE_PATH", ":memory:")
+SEARCH_CACHE_SIZE = int(getenv("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CACHE_TTL = float(getenv("SEARCH_CACHE_TTL", 300))
+FETCH_TIMEOUT = float(getenv("FETCH_TIMEOUT", 10))
+FETCH_MAX_BYTES = int(getenv("FETCH_MAX_BYTES", 5 * 2 ** 20))
+FETCH_MAX_CONNECTIONS = int(getenv("FETCH_MAX_CONNECTIONS", 64))
+FETCH_MAX_PER_HOST = int(getenv("FETCH_MAX_PER_HOST", 4))
+FETCH_CACHE_SIZE = int(getenv("FETCH_CACHE_SIZE", 1024))
+GENERATION_WORKERS = int(getenv("GENERATION_WORKERS", 1))
+GENERATION_QUEUE_SIZE = int(getenv("GENERATION_QUEUE_SIZE", 16))
 
 fake_users_db = {
     "johndoe": {
@@ -171,23 +240,140 @@ class ArticleUrl(BaseModel):
     origin: HttpUrl
     hostname: str
     pathname: str
+    strategy: str | None = None
 
 
-class HealthCheckResponse(BaseModel):
-    status: str
+class ArticleUrlBatch(BaseModel):
+    urls: list[HttpUrl]
+    strategy: str | None = None
+
 
+class QueryBatch(BaseModel):
+    collection_id: str
+    source_name: str
+    queries: list[str] = Field(min_length=1, max_length=32)
+    limit: int = Field(3, ge=1, le=50)
+    profile: str | None = None
+    mode: str | None = None
 
-calculator = EmbeddingsCalculator()
 
-database = VectorDB()
+class HealthCheckResponse(BaseModel):
+    status: str
+
 
-generator = QuestionGeneratorTransformers()
+calculator = EmbeddingsCalculator(executor=InferenceExecutor(max_workers=EMBEDDING_WORKERS,
+                                                             max_queue_size=EMBEDDING_QUEUE_SIZE,
+                                                             name="embeddings"),
+                                 cache=LRUCache(max_size=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL),
+                                 dtype=EMBEDDING_DTYPE,
+                                 backend=INFERENCE_BACKEND,
+                                 num_threads=ONNX_THREADS,
+                                 quantize=ONNX_QUANTIZE)
+
+batcher = EmbeddingBatcher(calculator,
+                           max_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+                           max_batch_size=EMBEDDING_BATCH_SIZE,
+                           max_queue_size=EMBEDDING_QUEUE_SIZE,
+                           num_workers=EMBEDDING_WORKERS)
+
+database = VectorDB(storage=QDRANT_STORAGE,
+                    api_key=QDRANT_API_KEY,
+                    search_cache=LRUCache(max_size=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL),
+                    upsert_batch_size=QDRANT_UPSERT_BATCH_SIZE,
+                    upsert_parallel=QDRANT_UPSERT_PARALLEL)
+
+generator = QuestionGeneratorTransformers(executor=InferenceExecutor(max_workers=GENERATION_WORKERS,
+                                                                     max_queue_size=GENERATION_QUEUE_SIZE,
+                                                                     name="generator"),
+                                          backend=INFERENCE_BACKEND,
+                                          num_threads=ONNX_THREADS,
+                                          quantize=ONNX_QUANTIZE)
+
+if PRELOAD_MODELS:
+    # load the weights in the parent process so forked workers share them copy-on-write. Running the models here
+    # would start thread pools that do not survive the fork, so warming up is left to each worker.
+    calculator.load()
+    generator.load()
+
+jobs = JobManager(max_workers=INGESTION_WORKERS)
+
+# digest of every content being ingested, resolved with its number of vectors, or None if the ingestion fails
+ingestions_in_progress: dict[str, asyncio.Future] = {}
+
+# uses its own instance of the tokenizer of the embedding model, which is loaded with the first ingestion
+chunker = LazyModel("chunker", lambda: TextChunker(calculator.load_tokenizer(),
+                                                   max_tokens=min(CHUNK_MAX_TOKENS, calculator.max_seq_length),
+                                                   overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                                                   min_tokens=CHUNK_MIN_TOKENS))
+
+ingestion_index = IngestionIndex(INGESTION_INDEX_PATH)
+
+unit_cache = UnitCache(UNIT_CACHE_PATH)
+
+sparse_indexes = SparseIndexStore(SPARSE_INDEX_PATH)
+
+fetcher = PageFetcher(parse=readable_content,
+                      timeout=FETCH_TIMEOUT,
+                      max_bytes=FETCH_MAX_BYTES,
+                      max_connections=FETCH_MAX_CONNECTIONS,
+                      max_per_host=FETCH_MAX_PER_HOST,
+                      cache=LRUCache(max_size=FETCH_CACHE_SIZE, ttl=None))
+# processes extracting large PDFs, started by the lifespan of every worker process instead of at import
+pdf_pool = None
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/token")
 
-app = FastAPI()
+startup_report = {"import_seconds": IMPORT_SECONDS,
+                  "module_seconds": None,
+                  "warm_up_seconds": None,
+                  "warm_up_status": "pending" if MODEL_WARMUP else "disabled"}
+
+
+async def warm_up_models():
+    """
+    Load and warm up the models in their inference threads, one after the other, while the server already accepts
+    connections. Readiness is reported by /api/v1/readyz.
+    """
+    start = perf_counter()
+    try:
+        await calculator.executor.run(calculator.warm_up, wait=True)
+        await generator.executor.run(generator.warm_up, wait=True)
+    except Exception:
+        logging.exception("Model warm up failed, loading the models without warming them up")
+        startup_report["warm_up_status"] = "failed"
+        for model in (calculator, generator):
+            try:
+                await model.executor.run(model.load, wait=True)
+            except Exception:
+                logging.exception(f"Could not load {model.model_id}, it will be loaded on first use")
+        return
+    startup_report["warm_up_seconds"] = perf_counter() - start
+    startup_report["warm_up_status"] = "done"
+    logging.info(f"Startup report: {startup_report}, embeddings: {calculator.status()}, "
+                 f"generator: {generator.status()}")
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    global pdf_pool
+    if SERVER_WORKERS > 1:
+        logging.info(f"Running {SERVER_WORKERS} workers, the ingestion endpoints are disabled")
+    elif PDF_EXTRACTION_WORKERS > 1:
+        pdf_pool = pdf_extraction_pool(PDF_EXTRACTION_WORKERS)
+    warm_up_task = asyncio.create_task(warm_up_models()) if MODEL_WARMUP else None
+    yield
+    if warm_up_task:
+        warm_up_task.cancel()
+    await batcher.close()
+    await fetcher.close()
+    if pdf_pool:
+        pdf_pool.shutdown(cancel_futures=True)
+    await database.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -202,6 +388,12 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(InferenceQueueFull)
+async def inference_queue_full_handler(request: Request, exc: InferenceQueueFull):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, try again later"},
+                        headers={"Retry-After": "1"})
+
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -327,6 +519,21 @@ def insert_query_to_fake_db(username, source_name, query, hits):
     return fake_history_db[username]
 
 
+def insert_queries_to_fake_db(username, source_name, queries, hits_per_query):
+    date = datetime.utcnow()
+    fake_history_db[username].extend(
+        {
+            'id': uuid.uuid4().hex,
+            'username': username,
+            'source_name': source_name,
+            'date': date,
+            'query': query,
+            'responses': hits,
+        }
+        for query, hits in zip(queries, hits_per_query))
+    return fake_history_db[username]
+
+
 def get_fake_history(username):
     return fake_history_db[username]
 
@@ -392,91 +599,609 @@ async def history(current_user: Annotated[User, Depends(get_current_user)]):
     return get_fake_history(current_user.username)
 
 
-async def store_embeddings(collection_id: str, text_units: list[str]):
-    questions = generator.generate_questions(text_units)
-    embeddings = calculator.get_questions_embeddings(questions, text_units)
-    await database.insert_into(collection_id, embeddings)
-    return len(embeddings)
+async def store_embeddings(collection_id: str, text_units: list[str], job: IngestionJob | None = None,
+                           existing_ids: set | frozenset = frozenset(), strategy: str = "generated-question"):
+    """
+    Embed the text units with the indexing strategy of the collection and insert them.
+    :param collection_id: the collection where the vectors are inserted
+    :param text_units: lines or blocks of text extracted from the source
+    :param job: optional job whose progress is updated after every chunk
+    :param existing_ids: ids of the points already stored in the collection
+    :param strategy: one of INDEXING_STRATEGIES
+    :return int: number of vectors in the collection
+    """
+    counts = await store_documents([(collection_id, text_units, job, existing_ids)], strategy)
+    return counts[0]
 
 
-@app.post("/api/v1/url")
-async def submit_article(article_url: ArticleUrl, current_user: Annotated[User, Depends(get_current_user)]):
+async def store_documents(documents: list[tuple], strategy: str = "generated-question") -> list[int]:
     """
-    :param current_user: contains information about the current session
-    :param article_url: the url of the article with some info about the domain
-    :return dict: contains url info, the collection_id in the vector database and the number of vectors
+    Embed the text units of one or more documents and insert them in their collections. The units of all the
+    documents are split in chunks that flow through generate, embed and upsert stages connected by bounded queues, so
+    the stages overlap, the models receive full batches even when the documents are small, and the vectors of the
+    first chunks are searchable while the rest is still being processed. Units already in their collection are
+    skipped, units repeated across documents are sent to the models once and units found in the unit cache are not
+    sent to the models at all.
+    :param documents: tuples of collection_id, text units, optional job whose progress is updated after every chunk
+    and ids of the points already stored in the collection
+    :param strategy: one of INDEXING_STRATEGIES, shared by all the documents
+    :return list[int]: number of vectors in the collection of every document
+    """
+    vector_names = INDEXING_STRATEGIES[strategy]
+    question_key = f"{generator.model_id}|{calculator.model_id}"
+    passage_key = f"passage|{calculator.model_id}"
+    for _, text_units, job, _ in documents:
+        if job:
+            job.total = len(text_units)
+
+    def assemble(pending: list[str], cached: dict, missing: list[str], computed: np.ndarray) -> np.ndarray:
+        if len(missing) == len(pending):
+            # nothing came from the cache, hand the matrix over as it is
+            return computed
+        cached.update({unit: (None, vector) for unit, vector in zip(missing, computed)})
+        return np.stack([cached[unit][1] for unit in pending])
+
+    async def generate(chunk: list[tuple[int, str]]):
+        # dict keeps the order and drops repeated units, which share the same point
+        pending = list(dict.fromkeys((doc_idx, unit) for doc_idx, unit in chunk
+                                     if database.point_id(unit) not in documents[doc_idx][3]))
+        units = list(dict.fromkeys(unit for _, unit in pending))
+        if "question" not in vector_names or not units:
+            return chunk, pending, units, {}, [], []
+        cached = unit_cache.get_many(question_key, units)
+        missing = [unit for unit in units if unit not in cached]
+        questions = await generator.generate_questions_async(missing) if missing else []
+        return chunk, pending, units, cached, missing, questions
+
+    async def embed(item):
+        chunk, pending, units, cached, missing, new_questions = item
+        if not units:
+            return chunk, pending, units, [], {}
+        vectors = {}
+        questions = [None] * len(units)
+        if "question" in vector_names:
+            computed = np.empty((0, 0), np.float32)
+            if missing:
+                _, computed, _ = await calculator.get_questions_embeddings_array_async(new_questions, missing)
+                unit_cache.put_many(question_key, new_questions, computed, missing)
+            new = dict(zip(missing, new_questions))
+            questions = [new[unit] if unit in new else cached[unit][0] for unit in units]
+            vectors["question"] = assemble(units, cached, missing, computed)
+        if "passage" in vector_names:
+            cached_passages = unit_cache.get_many(passage_key, units)
+            missing_passages = [unit for unit in units if unit not in cached_passages]
+            computed = np.empty((0, 0), np.float32)
+            if missing_passages:
+                computed = await calculator.calculate_array_async(missing_passages)
+                unit_cache.put_many(passage_key, [""] * len(missing_passages), computed, missing_passages)
+            vectors["passage"] = assemble(units, cached_passages, missing_passages, computed)
+        return chunk, pending, units, questions, vectors
+
+    async def upsert(item):
+        chunk, pending, units, questions, vectors = item
+        rows_by_document: dict[int, list[int]] = {}
+        position = {unit: row for row, unit in enumerate(units)}
+        for doc_idx, unit in pending:
+            rows_by_document.setdefault(doc_idx, []).append(position[unit])
+        for doc_idx, rows in rows_by_document.items():
+            if rows == list(range(len(units))):
+                # the chunk belongs to one document, rows are already in order
+                doc_questions, doc_units, doc_vectors = questions, units, vectors
+            else:
+                doc_questions = [questions[row] for row in rows]
+                doc_units = [units[row] for row in rows]
+                doc_vectors = {name: matrix[rows] for name, matrix in vectors.items()}
+            ids = [database.point_id(unit) for unit in doc_units]
+            await database.insert_arrays(documents[doc_idx][0], doc_questions,
+                                         doc_vectors if len(doc_vectors) > 1 else doc_vectors[vector_names[0]],
+                                         doc_units,
+                                         ids=ids)
+            sparse_indexes.add(documents[doc_idx][0], ids, doc_units)
+        for doc_idx, processed in Counter(doc_idx for doc_idx, _ in chunk).items():
+            if documents[doc_idx][2]:
+                documents[doc_idx][2].advance(processed)
+
+    items = [(doc_idx, unit) for doc_idx, (_, text_units, _, _) in enumerate(documents) for unit in text_units]
+    chunks = (items[i:i + INGESTION_CHUNK_SIZE] for i in range(0, len(items), INGESTION_CHUNK_SIZE))
+    await run_stages(chunks, generate, embed, upsert, max_queue_size=INGESTION_QUEUE_SIZE)
+    counts = await asyncio.gather(*(database.count_collection(collection_id) for collection_id, *_ in documents))
+    return [count.count for count in counts]
+
+
+async def open_collection(text_units: list[str], source_name: str, job: IngestionJob,
+                          strategy: str = "generated-question",
+                          before_waiting: Callable[[], None] | None = None) -> dict | tuple[str, str, set]:
     """
-    # First check if collection already exists to avoid recreating it
-    collection_id = str(hash(article_url.href))
+    Find or create the collection where the text units of a document are ingested, addressed by their content digest
+    and indexing strategy. New collections are named after the digest unless another entry already uses that name.
+    If the same content was already ingested with that strategy, or is being ingested by another job, nothing has to
+    be generated nor embedded; in the latter case the job waits for the other one and fails if it fails. If the
+    source was ingested before with different content, the units it keeps are copied from its previous collection
+    instead of being generated and embedded again. The previous collection stays searchable until the new one is
+    complete, and it is deleted then if no other source uses it.
+    :param text_units: lines or blocks of text extracted from the source
+    :param source_name: url or file name of the source
+    :param job: the job of the ingestion
+    :param strategy: one of INDEXING_STRATEGIES
+    :param before_waiting: called before waiting for another job that is ingesting the same content
+    :return: the result of the ingestion if the content was deduplicated, otherwise the digest, the collection_id and
+    the ids of the points already stored in the collection. The caller must store the units and then call
+    close_collection.
+    """
+    digest = collection_key(text_units, strategy)
+
+    entry = ingestion_index.get(digest)
+    if entry and (entry["status"] == "ingesting" or await database.collection_exists(entry["collection_id"])):
+        ingestion_index.add_source(digest, source_name, job.username)
+        job.collection_id = entry["collection_id"]
+        job.deduplicated = True
+        job.total = entry["total_units"]
+        total_vectors = entry["total_vectors"]
+        if entry["status"] == "ingesting" and digest in ingestions_in_progress:
+            if before_waiting:
+                before_waiting()
+            total_vectors = await asyncio.shield(ingestions_in_progress[digest])
+            if total_vectors is None:
+                raise RuntimeError("The ingestion of the same content by another job failed, submit it again")
+        # the source now holds this content, it leaves the entry of the content it had before
+        await drop_collections(ingestion_index.release_source(digest, source_name, job.username))
+        job.processed = job.total
+        return {"collection_id": entry["collection_id"], "total_vectors": total_vectors, "deduplicated": True}
+
+    previous_digest = ingestion_index.find_source(source_name, strategy)
+    previous = ingestion_index.get(previous_digest) if previous_digest else None
+    # the digest may name the collection of an entry written by an older version, never replace it
+    collection_id = digest if not ingestion_index.collection_in_use(digest) else uuid.uuid4().hex
+    ingestion_index.start(digest, collection_id, source_name, len(text_units), job.username, strategy)
+    # registered before any await, so duplicates submitted from now on wait for this ingestion
+    ingestions_in_progress[digest] = asyncio.get_running_loop().create_future()
+    job.collection_id = collection_id
+
     try:
-        await database.create_collection(collection_id)
-    except ValueError:
-        # collection already exists
-        count = await database.count_collection(collection_id)
-        return {"url": article_url.href,
-                "collection_id": collection_id,
-                "total_vectors": count["count"]}
+        vector_names = INDEXING_STRATEGIES[strategy]
+        await database.create_or_replace_collection(collection_id, profile=COLLECTION_PROFILE,
+                                                    index_profile=INDEX_PROFILE,
+                                                    vector_names=vector_names if len(vector_names) > 1 else None)
+        sparse_indexes.create(collection_id)
+        existing_ids = set()
+        if (previous and previous["status"] == "ready"
+                and await database.collection_exists(previous["collection_id"])):
+            units_by_id = {database.point_id(unit): unit for unit in text_units}
+            existing_ids = await database.get_point_ids(previous["collection_id"]) & units_by_id.keys()
+            await database.copy_points(previous["collection_id"], collection_id, list(existing_ids))
+            sparse_indexes.add(collection_id, list(existing_ids), [units_by_id[point_id] for point_id in existing_ids])
+    except Exception:
+        await abort_collection(digest, collection_id)
+        raise
+    return digest, collection_id, existing_ids
+
+
+async def abort_collection(digest: str, collection_id: str) -> None:
+    # remove the partial collection so the source can be submitted again. It was created by the failed job, the
+    # collection of the previous content of the source is left untouched.
+    ingestion_index.remove(digest)
+    sparse_indexes.delete(collection_id)
+    finish_ingestion(digest, None)
+    await database.delete_collection(collection_id)
+
+
+def finish_ingestion(digest: str, total_vectors: int | None) -> None:
+    future = ingestions_in_progress.pop(digest, None)
+    if future is not None and not future.done():
+        future.set_result(total_vectors)
+
+
+async def drop_collections(entries: list[dict]) -> None:
+    """
+    Delete the collections of index entries that no source uses anymore
+    """
+    for entry in entries:
+        sparse_indexes.delete(entry["collection_id"])
+        try:
+            await database.delete_collection(entry["collection_id"])
+        except Exception:
+            logging.exception(f"Could not delete the unused collection {entry['collection_id']}")
+
+
+async def close_collection(digest: str, collection_id: str, total_vectors: int) -> dict:
+    await jobs.run_blocking(sparse_indexes.save, collection_id)
+    replaced = ingestion_index.complete(digest, total_vectors)
+    finish_ingestion(digest, total_vectors)
+    await drop_collections(replaced)
+    return {"collection_id": collection_id, "total_vectors": total_vectors, "deduplicated": False}
+
+
+async def ingest_text_units(text_units: list[str], source_name: str, job: IngestionJob,
+                            strategy: str = "generated-question"):
+    """
+    Ingest the text units of a document into the collection addressed by their content digest and indexing strategy.
+    See open_collection for how repeated and updated content is handled.
+    :param text_units: lines or blocks of text extracted from the source
+    :param source_name: url or file name of the source
+    :param job: the job whose progress is updated
+    :param strategy: one of INDEXING_STRATEGIES
+    :return dict: the collection_id, the number of vectors and whether the content was deduplicated
+    """
+    opened = await open_collection(text_units, source_name, job, strategy)
+    if isinstance(opened, dict):
+        return opened
+    digest, collection_id, existing_ids = opened
+    try:
+        total_vectors = await store_embeddings(collection_id, text_units, job, existing_ids, strategy)
+    except Exception:
+        await abort_collection(digest, collection_id)
+        raise
+    return await close_collection(digest, collection_id, total_vectors)
+
+
+def chunk_text_units(text_units: list[str]) -> list[str]:
+    """
+    Pack the units extracted by the cleaners into chunks sized for the embedding model, unless chunking is disabled
+    """
+    if not TEXT_CHUNKING:
+        return text_units
+    return chunker.get().chunk(text_units)
+
+
+async def fetch_article_lines(url: str) -> list[str]:
+    page = await fetcher.fetch(url)
+    readable_html = page.content
 
-    readable_html = get_readable_html(article_url.href)
+    def extract_lines():
+        lines = HtmlCleaner(readable_html, streaming=HTML_STREAMING_CLEANER).extract_text_lines()
+        return chunk_text_units(lines)
 
-    cleaner = HtmlCleaner(readable_html)
-    lines = cleaner.extract_text_lines()
+    return await jobs.run_blocking(extract_lines)
 
-    total_vectors = await store_embeddings(collection_id, lines)
+
+async def ingest_article(url: str, job: IngestionJob, strategy: str):
+    lines = await fetch_article_lines(url)
+    return await ingest_text_units(lines, url, job, strategy)
+
+
+async def ingest_batched_article(url: str, job: IngestionJob, strategy: str, batch: IngestionBatch):
+    """
+    Fetch and clean an article concurrently with the other articles of a bulk submission, then store its text units
+    together with theirs
+    """
+    storing = False
+    skipped = False
+
+    def skip():
+        # a duplicate of another article of the batch leaves it before waiting, or the batch would never start
+        nonlocal skipped
+        if not skipped:
+            skipped = True
+            batch.skip()
+
+    try:
+        lines = await fetch_article_lines(url)
+        opened = await open_collection(lines, url, job, strategy, before_waiting=skip)
+        if isinstance(opened, dict):
+            return opened
+        digest, collection_id, existing_ids = opened
+        storing = True
+        try:
+            total_vectors = await batch.store((collection_id, lines, job, existing_ids))
+        except Exception:
+            await abort_collection(digest, collection_id)
+            raise
+        return await close_collection(digest, collection_id, total_vectors)
+    finally:
+        if not storing:
+            skip()
+
+
+async def ingest_pdf(file_name: str, bytes_content: bytes, job: IngestionJob, strategy: str):
+    def extract_blocks():
+        cleaner = PyMuPdfCleaner(mem_file=bytes_content)
+        blocks = cleaner.extract_text_blocks(pdf_pool, workers=PDF_EXTRACTION_WORKERS)
+        cleaner.close_document()
+        return chunk_text_units(blocks)
+
+    blocks = await jobs.run_blocking(extract_blocks)
+    # file names are only unique per user
+    return await ingest_text_units(blocks, f"{job.username}/{file_name}", job, strategy)
+
+
+def get_profile(profile: str | None) -> str | None:
+    if profile is not None and profile not in INDEX_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile, use one of {', '.join(INDEX_PROFILES)}")
+    return profile
+
+
+def get_retrieval_mode(mode: str | None) -> str:
+    if mode is None:
+        return RETRIEVAL_MODE
+    if mode not in ("dense", "hybrid"):
+        raise HTTPException(status_code=400, detail="Unknown mode, use dense or hybrid")
+    return mode
+
+
+async def fuse_sparse_hits(collection_id: str, query: str, dense_hits: list, limit: int) -> list:
+    """
+    Fuse the hits of a dense search, fetched with HYBRID_CANDIDATES candidates, with the BM25 hits of the query.
+    Collections without a sparse index keep the dense hits.
+    """
+    sparse_hits = sparse_indexes.search(collection_id, query, max(limit, HYBRID_CANDIDATES))
+    if sparse_hits is None:
+        return dense_hits[:limit]
+    return await database.fuse_hits(collection_id, dense_hits, [point_id for point_id, _ in sparse_hits], limit, RRF_K)
+
+
+async def search_hits(collection_id: str, query: str, query_vector: list, limit: int, profile: str | None,
+                      mode: str) -> list:
+    if mode == "dense":
+        return await database.search_collection(collection_id, query_vector, limit, profile)
+    dense_hits = await database.search_collection(collection_id, query_vector, max(limit, HYBRID_CANDIDATES), profile)
+    return await fuse_sparse_hits(collection_id, query, dense_hits, limit)
+
+
+def require_ingestion() -> None:
+    """
+    Ingestion jobs, the content index, the in-progress ingestions and the caches live in the memory of a worker, so
+    with several workers a job could not be polled from another worker and workers would overwrite the index of each
+    other. Only the query endpoints are served then.
+    """
+    if SERVER_WORKERS > 1:
+        raise HTTPException(status_code=501,
+                            detail=f"Ingestion is disabled in this server, which runs {SERVER_WORKERS} workers")
+
+
+def get_strategy(strategy: str | None) -> str:
+    if strategy is None:
+        return INDEXING_STRATEGY
+    if strategy not in INDEXING_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Unknown strategy, use one of {', '.join(INDEXING_STRATEGIES)}")
+    return strategy
+
+
+@app.post("/api/v1/url", dependencies=[Depends(require_ingestion)])
+async def submit_article(article_url: ArticleUrl, current_user: Annotated[User, Depends(get_current_user)]):
+    """
+    The collection_id is the digest of the article content, so it is known once the article has been fetched and
+    cleaned, and it is reported by the job status.
+    :param current_user: contains information about the current session
+    :param article_url: the url of the article with some info about the domain, and optionally the indexing strategy
+    :return dict: contains url info and the ingestion job
+    """
+    strategy = get_strategy(article_url.strategy)
+    job = jobs.create_job(current_user.username, str(article_url.href))
+    jobs.submit(job, ingest_article(str(article_url.href), job, strategy))
 
     return {"url": article_url.href,
-            "collection_id": collection_id,
-            "total_vectors": total_vectors}
+            "job_id": job.id,
+            "status": job.status}
 
 
-@app.post("/api/v1/pdf")
-async def submit_pdf(current_user: Annotated[User, Depends(get_current_user)], pdf: UploadFile = File(...)):
+@app.post("/api/v1/urls", dependencies=[Depends(require_ingestion)])
+async def submit_articles(article_urls: ArticleUrlBatch, current_user: Annotated[User, Depends(get_current_user)]):
+    """
+    Ingest a list of articles. They are fetched and cleaned concurrently and their text units share the batches of
+    question generation and embedding. Every article gets its own job and collection, like in /api/v1/url.
+    :param current_user: contains information about the current session
+    :param article_urls: the urls of the articles and optionally the indexing strategy of all of them
+    :return dict: the batch_id and the job of every url
     """
+    strategy = get_strategy(article_urls.strategy)
+    urls = list(dict.fromkeys(str(url) for url in article_urls.urls))
+    if not urls:
+        raise HTTPException(status_code=400, detail="No urls were submitted")
+    if len(urls) > BULK_INGESTION_MAX_URLS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_INGESTION_MAX_URLS} urls can be submitted at once")
+
+    batch = IngestionBatch(len(urls), lambda documents: store_documents(documents, strategy))
+    url_jobs = []
+    for url in urls:
+        job = jobs.create_job(current_user.username, url, batch_id=batch.id)
+        jobs.submit(job, ingest_batched_article(url, job, strategy, batch))
+        url_jobs.append({"url": url, "job_id": job.id, "status": job.status})
+
+    return {"batch_id": batch.id,
+            "jobs": url_jobs}
+
+
+@app.get("/api/v1/urls/{batch_id}", dependencies=[Depends(require_ingestion)])
+async def articles_status(batch_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+    batch_jobs = jobs.get_user_jobs(current_user.username, batch_id)
+    if not batch_jobs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {"batch_id": batch_id,
+            "completed": sum(job.status == "completed" for job in batch_jobs),
+            "failed": sum(job.status == "failed" for job in batch_jobs),
+            "jobs": [job.to_dict() for job in batch_jobs]}
+
+
+@app.post("/api/v1/pdf", dependencies=[Depends(require_ingestion)])
+async def submit_pdf(current_user: Annotated[User, Depends(get_current_user)], pdf: UploadFile = File(...),
+                     strategy: str | None = None):
+    """
+    The collection_id is the digest of the document content and it is reported by the job status.
     :param current_user: contains information about the current session
     :param pdf: the pdf file
-    :return dict: contains the url and the number of vectors
+    :param strategy: indexing strategy: "generated-question", "direct-passage" or "hybrid"
+    :return dict: contains the file name and the ingestion job
     """
-    # First check if collection already exists to avoid recreating it
-    collection_id = str(hash(current_user.username + pdf.filename))
-    try:
-        await database.create_collection(collection_id)
-    except ValueError:
-        # collection already exists
-        return {"file_name": pdf.filename,
-                "collection_id": collection_id,
-                "total_vectors": await database.count_collection(collection_id)}
+    strategy = get_strategy(strategy)
+    bytes_content = await pdf.read()
+    await pdf.close()
+
+    job = jobs.create_job(current_user.username, pdf.filename)
+    jobs.submit(job, ingest_pdf(pdf.filename, bytes_content, job, strategy))
 
-    bytes_content = pdf.file.read()
+    return {"file_name": pdf.filename,
+            "job_id": job.id,
+            "status": job.status}
 
-    cleaner = PyMuPdfCleaner(mem_file=bytes_content)
-    blocks = cleaner.extract_text_blocks()
 
-    total_vectors = await store_embeddings(collection_id, blocks)
+@app.get("/api/v1/jobs", dependencies=[Depends(require_ingestion)])
+async def list_jobs(current_user: Annotated[User, Depends(get_current_user)]):
+    return [job.to_dict() for job in jobs.get_user_jobs(current_user.username)]
 
-    pdf.file.close()
-    cleaner.close_document()
 
-    return {"file_name": pdf.filename,
-            "collection_id": collection_id,
-            "total_vectors": total_vectors}
+@app.get("/api/v1/jobs/{job_id}", dependencies=[Depends(require_ingestion)])
+async def job_status(job_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+    job = jobs.get_job(job_id)
+    if not job or job.username != current_user.username:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 
 @app.get("/api/v1/query")
 async def query_collection(collection_id: str, query: str, source_name: str,
-                           current_user: Annotated[User, Depends(get_current_user)]):
+                           current_user: Annotated[User, Depends(get_current_user)],
+                           limit: Annotated[int, Query(ge=1, le=50)] = 3,
+                           profile: str | None = None,
+                           mode: str | None = None):
+    """
+    :param limit: number of returned hits
+    :param profile: search profile: "fast", "balanced" or "exact". Defaults to the parameters of the collection.
+    :param mode: "dense" searches the embeddings only, "hybrid" fuses them with the BM25 index of the collection
+    """
+    profile = get_profile(profile)
+    mode = get_retrieval_mode(mode)
     decoded_id = unquote(collection_id).strip()
     decoded_query = unquote(query)
-    query_embeddings = calculator.calculate(decoded_query)
-    hits = await database.search_collection(decoded_id, query_embeddings)
+    query_embeddings = await batcher.embed(decoded_query)
+    hits = await search_hits(decoded_id, decoded_query, query_embeddings, limit, profile, mode)
     insert_query_to_fake_db(current_user.username, source_name, decoded_query, hits)
     return {"id": decoded_id, "query": decoded_query, "hits": hits}
 
 
+@app.post("/api/v1/query/batch")
+async def query_collection_batch(query_batch: QueryBatch, current_user: Annotated[User, Depends(get_current_user)]):
+    """
+    Answer several queries against one collection, with a single embedding call and a single batched search
+    :param query_batch: the collection, the queries and the search options
+    :param current_user: contains information about the current session
+    :return dict: the hits of every query, in the same order
+    """
+    profile = get_profile(query_batch.profile)
+    mode = get_retrieval_mode(query_batch.mode)
+    collection_id = query_batch.collection_id.strip()
+    queries_embeddings = await calculator.calculate_async(query_batch.queries)
+    candidates = query_batch.limit if mode == "dense" else max(query_batch.limit, HYBRID_CANDIDATES)
+    hits_per_query = await database.search_collection_batch(collection_id, queries_embeddings, candidates, profile)
+    if mode == "hybrid":
+        hits_per_query = await asyncio.gather(*(fuse_sparse_hits(collection_id, query, hits, query_batch.limit)
+                                                for query, hits in zip(query_batch.queries, hits_per_query)))
+    insert_queries_to_fake_db(current_user.username, query_batch.source_name, query_batch.queries, hits_per_query)
+    return {"id": collection_id,
+            "results": [{"query": query, "hits": hits}
+                        for query, hits in zip(query_batch.queries, hits_per_query)]}
+
+
+@app.get("/api/v1/library")
+async def library(current_user: Annotated[User, Depends(get_current_user)]):
+    return [{"collection_id": collection_id, "sources": sources}
+            for collection_id, sources in ingestion_index.user_collections(current_user.username).items()]
+
+
+@app.get("/api/v1/library/query")
+async def query_library(query: str, current_user: Annotated[User, Depends(get_current_user)],
+                        limit: Annotated[int, Query(ge=1, le=50)] = 3,
+                        profile: str | None = None,
+                        mode: str | None = None):
+    """
+    Search every document of the user at once. The query is embedded once and searched concurrently in all the
+    collections of the user, then the best hits are merged by cosine similarity, which is comparable between
+    collections. In hybrid mode the merged dense candidates and the BM25 hits of all the collections form two global
+    rankings that are fused by reciprocal rank fusion, and the scores are the fused scores.
+    :param query: the question
+    :param current_user: contains information about the current session
+    :param limit: number of returned hits in total
+    :param profile: search profile: "fast", "balanced" or "exact". Defaults to the parameters of the collections.
+    :param mode: "dense" or "hybrid", see /api/v1/query
+    :return dict: the best hits, each with its collection_id and sources
+    """
+    profile = get_profile(profile)
+    mode = get_retrieval_mode(mode)
+    decoded_query = unquote(query)
+    collections = ingestion_index.user_collections(current_user.username)
+    query_embeddings = await batcher.embed(decoded_query)
+
+    slots = asyncio.Semaphore(LIBRARY_SEARCH_CONCURRENCY)
+
+    candidates = limit if mode == "dense" else max(limit, HYBRID_CANDIDATES)
+
+    async def search(collection_id: str):
+        async with slots:
+            try:
+                return await database.search_collection(collection_id, query_embeddings, candidates, profile)
+            except Exception:
+                # the collection may have been removed after the index was read
+                logging.exception(f"Library search failed in collection {collection_id}")
+                return []
+
+    results = await asyncio.gather(*(search(collection_id) for collection_id in collections))
+    dense_ranking = heapq.nlargest(candidates,
+                                   ((hit, collection_id) for collection_id, collection_hits in zip(collections, results)
+                                    for hit in collection_hits),
+                                   key=lambda pair: pair[0].score)
+    if mode == "dense":
+        hits = dense_ranking
+    else:
+        sparse_ranking = heapq.nlargest(candidates,
+                                        ((point_id, score, collection_id) for collection_id in collections
+                                         for point_id, score in sparse_indexes.search(collection_id, decoded_query,
+                                                                                      candidates) or []),
+                                        key=lambda item: item[1])
+        fused = reciprocal_rank_fusion([[(collection_id, hit.id) for hit, collection_id in dense_ranking],
+                                        [(collection_id, point_id) for point_id, _, collection_id in sparse_ranking]],
+                                       RRF_K)[:limit]
+        scores_by_collection = {}
+        for (collection_id, point_id), score in fused:
+            scores_by_collection.setdefault(collection_id, []).append((point_id, score))
+        dense_hits = dict(zip(collections, results))
+        rescored = await asyncio.gather(*(database.rescore_hits(collection_id, scores, dense_hits[collection_id])
+                                          for collection_id, scores in scores_by_collection.items()))
+        by_key = {(collection_id, hit.id): hit
+                  for collection_id, collection_hits in zip(scores_by_collection, rescored) for hit in collection_hits}
+        hits = [(by_key[key], key[0]) for key, _ in fused if key in by_key]
+    merged = [{"collection_id": collection_id, "sources": collections[collection_id], "hit": hit}
+              for hit, collection_id in hits]
+    insert_query_to_fake_db(current_user.username, "library", decoded_query, [item["hit"] for item in merged])
+    return {"query": decoded_query, "hits": merged}
+
+
+@app.get("/api/v1/metrics/embeddings")
+async def embeddings_metrics():
+    return batcher.stats()
+
+
+@app.get("/api/v1/metrics/cache")
+async def cache_metrics():
+    return {"embeddings": calculator.cache.stats(),
+            "search": database.search_cache.stats(),
+            "units": unit_cache.stats(),
+            "pages": fetcher.stats(),
+            "sparse": sparse_indexes.stats()}
+
+
+@app.get("/api/v1/readyz")
+async def ready():
+    """
+    Readiness probe. While the models are warmed up at startup, answers 503 until they are loaded. When warm up is
+    disabled or failed, the models are loaded on first use and the server is ready at once. Reports the load and warm
+    up times of each model.
+    """
+    models = {"embeddings": calculator.status(), "generator": generator.status()}
+    loaded = all(model["loaded"] for model in models.values())
+    body = {"status": "ok" if loaded or startup_report["warm_up_status"] in ("disabled", "failed") else "loading",
+            "models": models,
+            "startup": startup_report}
+    if body["status"] != "ok":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
 @app.get("/api/v1/healthz", response_model=HealthCheckResponse)
 async def health():
     return {"status": "ok"}
 
 
+startup_report["module_seconds"] = perf_counter() - IMPORT_STARTED
+
 if __name__ == "__main__":
     import uvicorn
 
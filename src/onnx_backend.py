@@ -0,0 +1,110 @@
+"""
+Optional ONNX Runtime backend for the embedding and question generation models. It needs the packages listed in
+requirements_onnx.txt. Models are exported to ONNX the first time they are used, optionally quantized to int8 with
+dynamic quantization, and kept in a local directory so later starts load them directly.
+"""
+import logging
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "tfm-onnx"
+
+
+def _session_options(num_threads: int | None):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = 1
+    return options
+
+
+def _quantize_directory(source: Path, target: Path) -> None:
+    """
+    Copy an exported model and replace every ONNX file with its dynamically int8 quantized version
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    shutil.copytree(source, target)
+    for onnx_file in target.glob("*.onnx"):
+        quantized_file = onnx_file.with_suffix(".int8.onnx")
+        quantize_dynamic(onnx_file, quantized_file, weight_type=QuantType.QInt8)
+        quantized_file.replace(onnx_file)
+
+
+def _export(model_class, model_name: str, quantize: bool, cache_dir: Path | None) -> Path:
+    """
+    Directory of the ONNX version of a model, exporting and quantizing it if it is not there yet
+    """
+    cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+    exported = cache_dir / model_name.replace("/", "--")
+    if not exported.exists():
+        logging.info(f"Exporting {model_name} to ONNX")
+        model = model_class.from_pretrained(model_name, export=True)
+        model.save_pretrained(exported)
+    if not quantize:
+        return exported
+    quantized = exported.with_name(exported.name + "-int8")
+    if not quantized.exists():
+        logging.info(f"Quantizing {model_name} to int8")
+        _quantize_directory(exported, quantized)
+    return quantized
+
+
+class OnnxSentenceEncoder:
+    def __init__(self, model_name: str, num_threads: int | None = None, quantize: bool = True,
+                 cache_dir: str | None = None, max_seq_length: int = 128):
+        """
+        Drop-in replacement of SentenceTransformer.encode for models made of a transformer and mean pooling, such
+        as paraphrase-multilingual-MiniLM-L12-v2.
+        :param model_name: SentenceTransformer name or Hugging Face id of the model
+        :param num_threads: intra-op threads of ONNX Runtime. None lets it decide.
+        :param quantize: use dynamic int8 quantization
+        :param cache_dir: directory of the exported models
+        :param max_seq_length: tokens per text, longer texts are truncated like SentenceTransformer does
+        """
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        model_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        model_dir = _export(ORTModelForFeatureExtraction, model_id, quantize, cache_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir,
+                                                                  session_options=_session_options(num_threads),
+                                                                  provider="CPUExecutionProvider")
+        self.max_seq_length = max_seq_length
+
+    def encode(self, sentences: str | list[str], batch_size: int = 32, convert_to_numpy: bool = True) -> np.ndarray:
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else sentences
+        embeddings = []
+        for i in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(sentences[i:i + batch_size],
+                                    padding=True,
+                                    truncation=True,
+                                    max_length=self.max_seq_length,
+                                    return_tensors="np")
+            token_embeddings = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., np.newaxis].astype(np.float32)
+            embeddings.append((token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+        if not embeddings:
+            return np.empty((0, 0), dtype=np.float32)
+        result = np.concatenate(embeddings).astype(np.float32, copy=False)
+        return result[0] if single else result
+
+
+def load_seq2seq_model(model_name: str, num_threads: int | None = None, quantize: bool = True,
+                       cache_dir: str | None = None):
+    """
+    ONNX Runtime version of a T5 model. It has the same generate method as T5ForConditionalGeneration.
+    """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    model_dir = _export(ORTModelForSeq2SeqLM, model_name, quantize, cache_dir)
+    return ORTModelForSeq2SeqLM.from_pretrained(model_dir,
+                                                session_options=_session_options(num_threads),
+                                                provider="CPUExecutionProvider")
+
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Iterable
+
+_END = object()
+
+
+async def run_stages(items: Iterable, *stages: Callable[[object], Awaitable], max_queue_size: int = 2) -> None:
+    """
+    Run items through a chain of async stages. Every stage runs in its own task and is connected to the next one by
+    a bounded queue, so a stage can work on an item while the following stage processes the previous one, and no
+    more than max_queue_size items wait between two stages.
+    :param items: inputs of the first stage
+    :param stages: async functions; each receives the output of the previous one
+    :param max_queue_size: maximum number of items waiting between two stages
+    :raises: the first exception raised by a stage, after cancelling the others
+    """
+    queues = [asyncio.Queue(maxsize=max_queue_size) for _ in stages]
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+        await queues[0].put(_END)
+
+    async def work(stage, inbox: asyncio.Queue, outbox: asyncio.Queue | None):
+        while True:
+            item = await inbox.get()
+            if item is _END:
+                break
+            result = await stage(item)
+            if outbox is not None:
+                await outbox.put(result)
+        if outbox is not None:
+            await outbox.put(_END)
+
+    tasks = [asyncio.create_task(feed())]
+    for idx, stage in enumerate(stages):
+        outbox = queues[idx + 1] if idx + 1 < len(stages) else None
+        tasks.append(asyncio.create_task(work(stage, queues[idx], outbox)))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
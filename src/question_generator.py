@@ -1,19 +1,77 @@
 from os import getenv
 from pathlib import Path
-from time import time
+from time import time, perf_counter
 
 from dotenv import load_dotenv
 from openai import OpenAI
-from transformers import T5Tokenizer, T5ForConditionalGeneration
 
+from src.inference import InferenceExecutor, LazyModel
 from src.text_scraping import PyMuPdfCleaner
 
 
 class QuestionGeneratorTransformers:
-    def __init__(self):
-        self.tokenizer = T5Tokenizer.from_pretrained("google/flan-t5-base")
-        self.model = T5ForConditionalGeneration.from_pretrained("google/flan-t5-base")
+    def __init__(self, batch_size: int = 16, max_new_tokens: int = 64, max_input_tokens: int = 512,
+                 executor: InferenceExecutor | None = None, model_name: str = "google/flan-t5-base",
+                 backend: str = "torch", num_threads: int | None = None, quantize: bool = True):
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unsupported inference backend: {backend}")
+        self.model_name = model_name
+        self.backend = backend
+        # identifies the outputs of the model in persistent caches, quantized models give slightly different ones
+        self.model_id = model_name if backend == "torch" else f"{model_name}@onnx{'-int8' if quantize else ''}"
+        self.num_threads = num_threads
+        self.quantize = quantize
+        # the tokenizer and the model are loaded on first use or by warm_up
+        self._model = LazyModel(self.model_id, self._load_model)
+        self.warm_up_seconds = None
         self.instruction = "Generate a generic question that can be answered using the following text:\n\n"
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.max_input_tokens = max_input_tokens
+        self.executor = executor or InferenceExecutor(name="generator")
+
+    def _load_model(self):
+        from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+        tokenizer = T5Tokenizer.from_pretrained(self.model_name)
+        if self.backend == "onnx":
+            from src.onnx_backend import load_seq2seq_model
+
+            return tokenizer, load_seq2seq_model(self.model_name, num_threads=self.num_threads, quantize=self.quantize)
+        return tokenizer, T5ForConditionalGeneration.from_pretrained(self.model_name)
+
+    @property
+    def tokenizer(self):
+        return self._model.get()[0]
+
+    @property
+    def model(self):
+        return self._model.get()[1]
+
+    @property
+    def loaded(self) -> bool:
+        return self._model.loaded
+
+    def load(self) -> None:
+        """
+        Load the model without running it. Used to load the weights once before forking worker processes.
+        """
+        self._model.get()
+
+    def warm_up(self) -> None:
+        """
+        Load the model and generate one short question, so the first ingestion does not pay for it
+        """
+        start = perf_counter()
+        inputs = self.tokenizer(["warm up"], return_tensors="pt")
+        self.model.generate(**inputs, max_new_tokens=4)
+        self.warm_up_seconds = perf_counter() - start
+
+    def status(self) -> dict:
+        return {"model": self.model_id,
+                "loaded": self.loaded,
+                "load_seconds": self._model.load_seconds,
+                "warm_up_seconds": self.warm_up_seconds}
 
     def generate_question(self, prompt: str) -> list[str]:
         input_text = self.instruction + prompt
@@ -27,6 +85,43 @@ class QuestionGeneratorTransformers:
             questions.append(self.generate_question(answer))
         return questions
 
+    def generate_questions_batched(self, answers: list[str], batch_size: int | None = None) -> list[str]:
+        """
+        Generate one question per answer in padded micro-batches. Inputs are sorted by token length so that each
+        batch holds texts of similar size and padding is minimal. Questions are returned in the original order.
+        :param answers: text units to generate questions from
+        :param batch_size: number of inputs per call to generate. Defaults to the generator batch size.
+        :return questions: list of questions, one per answer
+        """
+        batch_size = batch_size or self.batch_size
+        input_texts = [self.instruction + answer for answer in answers]
+        lengths = [len(ids) for ids in self.tokenizer(input_texts, truncation=True,
+                                                      max_length=self.max_input_tokens).input_ids]
+        order = sorted(range(len(input_texts)), key=lambda idx: lengths[idx])
+
+        questions = [""] * len(input_texts)
+        for i in range(0, len(order), batch_size):
+            batch_indices = order[i:i + batch_size]
+            inputs = self.tokenizer([input_texts[idx] for idx in batch_indices],
+                                    return_tensors="pt",
+                                    padding=True,
+                                    truncation=True,
+                                    max_length=self.max_input_tokens)
+            outputs = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens)
+            decoded = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            for idx, question in zip(batch_indices, decoded):
+                questions[idx] = question
+        return questions
+
+    async def generate_questions_async(self, answers: list[str], wait: bool = True) -> list[str]:
+        """
+        Run the batched generation in the inference executor, without blocking the event loop
+        :param answers: text units to generate questions from
+        :param wait: wait for a free slot instead of raising InferenceQueueFull when the queue is full.
+        :return questions:
+        """
+        return await self.executor.run(self.generate_questions_batched, answers, wait=wait)
+
 
 class QuestionGeneratorOpenAI:
     def __init__(self, api_key: str, model: str = "gpt-3.5-turbo"):
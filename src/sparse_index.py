@@ -0,0 +1,168 @@
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Hashable, Iterable
+
+"""
+Terms of the sparse index: lowercase words, keeping the dots and hyphens inside model names, versions and numbers
+such as "gpt-3.5", "t5-base" or "1.5e-4"
+"""
+TERM = re.compile(r"\w+(?:[-.]\w+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    return TERM.findall(text.lower())
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list[Hashable]], k: int = 60) -> list[tuple[Hashable, float]]:
+    """
+    Merge rankings by summing 1 / (k + rank) for every ranking where an item appears. Only ranks are used, so
+    rankings with incomparable scores, such as cosine similarity and BM25, can be fused.
+    :param rankings: lists of ids, best first
+    :param k: damping of the first ranks
+    :return list[tuple]: ids and fused scores, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0) + 1 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """
+        Okapi BM25 over the text units of a collection, keyed by the ids of their points
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings: dict[str, dict[str, int]] = {}
+        self.lengths: dict[str, int] = {}
+        self.total_length = 0
+
+    def add(self, ids: list[str], texts: list[str]) -> None:
+        for point_id, text in zip(ids, texts):
+            if point_id in self.lengths:
+                continue
+            terms = tokenize(text)
+            self.lengths[point_id] = len(terms)
+            self.total_length += len(terms)
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, {})[point_id] = frequency
+
+    def remove(self, ids: Iterable[str]) -> None:
+        ids = {point_id for point_id in ids if point_id in self.lengths}
+        if not ids:
+            return
+        for term in list(self.postings):
+            documents = self.postings[term]
+            for point_id in ids.intersection(documents):
+                del documents[point_id]
+            if not documents:
+                del self.postings[term]
+        for point_id in ids:
+            self.total_length -= self.lengths.pop(point_id)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, float]]:
+        """
+        :return list[tuple]: ids of the best matching points and their scores, best first
+        """
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average_length = self.total_length / count or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (count - len(documents) + 0.5) / (len(documents) + 0.5))
+            for point_id, frequency in documents.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[point_id] / average_length)
+                scores[point_id] = scores.get(point_id, 0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:limit]
+
+    def to_dict(self) -> dict:
+        return {"k1": self.k1, "b": self.b, "postings": self.postings, "lengths": self.lengths}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(data["k1"], data["b"])
+        index.postings = data["postings"]
+        index.lengths = data["lengths"]
+        index.total_length = sum(index.lengths.values())
+        return index
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+
+class SparseIndexStore:
+    def __init__(self, path: str | None = None):
+        """
+        BM25 indexes of the collections. A collection has an index only if it was created with one, collections
+        ingested before keep being searched with dense vectors only.
+        :param path: optional directory where every index is saved as a JSON file when its ingestion completes.
+        Indexes are loaded from it on first use.
+        """
+        self.path = Path(path) if path else None
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+        self.indexes: dict[str, BM25Index] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, collection_id: str) -> Path:
+        return self.path / f"{collection_id}.json"
+
+    def get(self, collection_id: str) -> BM25Index | None:
+        index = self.indexes.get(collection_id)
+        if index is None and self.path and self._file(collection_id).exists():
+            with self._lock:
+                if collection_id not in self.indexes:
+                    with open(self._file(collection_id), "r") as f:
+                        self.indexes[collection_id] = BM25Index.from_dict(json.load(f))
+                index = self.indexes[collection_id]
+        return index
+
+    def create(self, collection_id: str) -> BM25Index:
+        self.indexes[collection_id] = BM25Index()
+        return self.indexes[collection_id]
+
+    def add(self, collection_id: str, ids: list[str], texts: list[str]) -> None:
+        index = self.get(collection_id)
+        if index is not None:
+            index.add(ids, texts)
+
+    def remove(self, collection_id: str, ids: Iterable[str]) -> None:
+        index = self.get(collection_id)
+        if index is not None:
+            index.remove(ids)
+
+    def search(self, collection_id: str, query: str, limit: int = 10) -> list[tuple[str, float]] | None:
+        """
+        :return: the best matching points, or None if the collection has no sparse index
+        """
+        index = self.get(collection_id)
+        return index.search(query, limit) if index is not None else None
+
+    def save(self, collection_id: str) -> None:
+        index = self.indexes.get(collection_id)
+        if self.path is None or index is None:
+            return
+        tmp_path = self._file(collection_id).with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index.to_dict(), f)
+        tmp_path.replace(self._file(collection_id))
+
+    def delete(self, collection_id: str) -> None:
+        self.indexes.pop(collection_id, None)
+        if self.path:
+            self._file(collection_id).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        return {"loaded_indexes": len(self.indexes),
+                "indexed_units": sum(len(index) for index in list(self.indexes.values())),
+                "terms": sum(len(index.postings) for index in list(self.indexes.values()))}
@@ -1,3 +1,10 @@
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from html.entities import html5 as html5_entities
+from html.parser import HTMLParser
+from typing import Iterator
+
 import requests
 from bs4 import BeautifulSoup
 from pypdf import PdfReader
@@ -6,25 +13,204 @@ import logging
 from readabilipy import simple_json_from_html_string
 
 
-def get_readable_html(url: str) -> str:
-    logging.debug("Requesting HTML")
-    response = requests.get(url)
-    article = simple_json_from_html_string(response.text, use_readability=False)
+def readable_content(html: str) -> str:
+    article = simple_json_from_html_string(html, use_readability=False)
     return article["content"]
 
 
+def get_readable_html(url: str, timeout: float = 10) -> str:
+    """
+    Blocking version of the download done by src.fetching.PageFetcher with readable_content as parser
+    """
+    logging.debug("Requesting HTML")
+    response = requests.get(url, timeout=timeout)
+    return readable_content(response.text)
+
+
+class _TextElementsCollector(HTMLParser):
+    """
+    Tokenizer of html.parser, the one BeautifulSoup uses with features="html.parser", that keeps the text of the
+    text elements outside stop elements without building a tree. It applies the same tree rules as BeautifulSoup, so
+    it finds the same elements and texts: no element is closed implicitly except void elements, an end tag closes
+    the most recent open element with its name and the ones opened after it, and end tags of elements that are not
+    open are ignored. Nested text elements get the text of their descendants, texts are released in the order their
+    elements start and strings made only of whitespace are collapsed like BeautifulSoup does.
+    """
+    VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+                     "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+                     "nextid", "spacer"}
+    PRESERVE_WHITESPACE_ELEMENTS = {"pre", "textarea"}
+
+    def __init__(self, stop_elements: set[str], text_elements: set[str]):
+        # character references are converted in handle_charref and handle_entityref, like BeautifulSoup does
+        super().__init__(convert_charrefs=False)
+        self.stop_elements = stop_elements
+        self.text_elements = text_elements
+        self.stop_depth = 0
+        self.preserve_depth = 0
+        # name and kind of every open element: "stop", "text" or None
+        self.open_elements: list[tuple[str, str | None]] = []
+        self.open_names: Counter = Counter()
+        self.closed_void_elements: list[str] = []
+        # text of the text elements that started, in order: [parts, finished]
+        self.texts: list[list] = []
+        self.open_texts: list[list] = []
+        self.finished: list[str] = []
+        self.pending_data: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        self._open(tag)
+        if tag in self.VOID_ELEMENTS:
+            self._close(tag)
+            self.closed_void_elements.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._open(tag)
+        self._close(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void_elements:
+            self.closed_void_elements.remove(tag)
+        else:
+            self._close(tag)
+
+    def handle_data(self, data):
+        if not self.stop_depth:
+            self.pending_data.append(data)
+
+    def handle_charref(self, name):
+        number = int(name[1:], 16) if name[:1] in ("x", "X") else int(name)
+        data = None
+        if number < 256:
+            try:
+                data = bytes([number]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(number)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        self.handle_data(html5_entities.get(name + ";", f"&{name}"))
+
+    def handle_comment(self, data):
+        self._flush_data()
+
+    def handle_decl(self, decl):
+        self._flush_data()
+
+    def handle_pi(self, data):
+        self._flush_data()
+
+    def unknown_decl(self, data):
+        self._flush_data()
+        if data.upper().startswith("CDATA[") and not self.stop_depth:
+            for parts, _ in self.open_texts:
+                parts.append(data[len("CDATA["):])
+
+    def close(self):
+        super().close()
+        self._flush_data()
+        for text in self.texts:
+            text[1] = True
+        self._release()
+
+    def _open(self, tag):
+        self._flush_data()
+        if tag in self.PRESERVE_WHITESPACE_ELEMENTS:
+            self.preserve_depth += 1
+        if tag in self.stop_elements:
+            self.stop_depth += 1
+            kind = "stop"
+        elif tag in self.text_elements and not self.stop_depth:
+            text = [[], False]
+            self.texts.append(text)
+            self.open_texts.append(text)
+            kind = "text"
+        else:
+            kind = None
+        self.open_elements.append((tag, kind))
+        self.open_names[tag] += 1
+
+    def _close(self, tag):
+        self._flush_data()
+        if not self.open_names[tag]:
+            return
+        while True:
+            name, kind = self.open_elements.pop()
+            self.open_names[name] -= 1
+            if name in self.PRESERVE_WHITESPACE_ELEMENTS:
+                self.preserve_depth -= 1
+            if kind == "stop":
+                self.stop_depth -= 1
+            elif kind == "text":
+                self.open_texts.pop()[1] = True
+            if name == tag:
+                break
+        self._release()
+
+    def _flush_data(self):
+        if not self.pending_data:
+            return
+        data, self.pending_data = "".join(self.pending_data), []
+        if not self.preserve_depth and data.strip(" \n\t\f\r") == "":
+            data = "\n" if "\n" in data else " "
+        for parts, _ in self.open_texts:
+            parts.append(data)
+
+    def _release(self):
+        released = 0
+        while released < len(self.texts) and self.texts[released][1]:
+            self.finished.append("".join(self.texts[released][0]))
+            released += 1
+        del self.texts[:released]
+
+
 class HtmlCleaner:
-    def __init__(self, html_body: str):
+    def __init__(self, html_body: str, streaming: bool = False):
+        """
+        :param html_body: the HTML to clean
+        :param streaming: extract the lines with iter_text_lines, a single pass of the html.parser tokenizer, instead of
+        building a BeautifulSoup tree
+        """
         self.stop_html_elements = ["head", "script", "style",
                                    "footer", "img", "button",
                                    "h1", "h2", "h3",
                                    "header", "web-header", "meta",
                                    "link", "nav"]
-
-        logging.debug("Parsing HTML")
-        self.soup = BeautifulSoup(html_body, features="html.parser")
+        self.text_html_elements = ["p", "ol", "ul", "blockquote"]
+        self.html_body = html_body
+        self.streaming = streaming
+        self.soup = None
+        if not streaming:
+            logging.debug("Parsing HTML")
+            self.soup = BeautifulSoup(html_body, features="html.parser")
         self.text = None
 
+    def iter_text_lines(self, chunk_size: int = 2 ** 16) -> Iterator[str]:
+        """
+        Yield the same lines as extract_text_lines while the HTML is parsed. Stop elements are skipped as they are
+        found and the text of every paragraph or list is split in lines as soon as it is complete.
+        :param chunk_size: characters fed to the parser at a time
+        """
+        collector = _TextElementsCollector(set(self.stop_html_elements), set(self.text_html_elements))
+        for start in range(0, len(self.html_body), chunk_size):
+            collector.feed(self.html_body[start:start + chunk_size])
+            yield from self._pop_lines(collector)
+        collector.close()
+        yield from self._pop_lines(collector)
+
+    @staticmethod
+    def _pop_lines(collector: _TextElementsCollector) -> Iterator[str]:
+        texts, collector.finished = collector.finished, []
+        for text in texts:
+            for line in text.splitlines():
+                if line != "":
+                    yield line
+
     def remove_elements_from_html(self) -> BeautifulSoup:
         """
         Remove undesired elements from HTML
@@ -60,8 +246,11 @@ class HtmlCleaner:
         Get lines from text
         :return lines: list of lines
         """
-        lines = self.extract_text_from_html().splitlines()
-        lines = list(filter(lambda line: line != "", lines))
+        if self.streaming:
+            lines = list(self.iter_text_lines())
+        else:
+            lines = self.extract_text_from_html().splitlines()
+            lines = list(filter(lambda line: line != "", lines))
         logging.debug(f"Number of lines {len(lines)}")
         return lines
 
@@ -78,26 +267,82 @@ class HtmlCleaner:
         logging.debug("Completed")
 
 
+def _page_text_blocks(page) -> list[str]:
+    text_blocks = []
+    for block in page.get_text("blocks"):
+        # same as len(block[4].split(" ")) > 8, without building the list of words
+        if block[4].count(" ") >= 8:
+            text_blocks.append(block[4].replace("\n", " "))
+    return text_blocks
+
+
+def _extract_page_range(pdf_path: str | None, mem_file: bytes | None, start: int, stop: int) -> list[list[str]]:
+    """
+    Text blocks of the pages in [start, stop), opening the document in the worker process
+    """
+    document = fitz.open(pdf_path) if mem_file is None else fitz.open(stream=mem_file, filetype="pdf")
+    try:
+        return [_page_text_blocks(document[page_num]) for page_num in range(start, stop)]
+    finally:
+        document.close()
+
+
+def _start_worker() -> None:
+    # unpickling this function imports the module, and PyMuPDF with it, in the worker
+    pass
+
+
+def pdf_extraction_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool for PyMuPdfCleaner.extract_text_blocks, meant to live as long as the application. Its processes are
+    started right away, so the first document does not pay for starting them and importing PyMuPDF.
+    """
+    # spawn instead of fork: the API process holds model thread pools that must not be forked
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    for _ in range(workers):
+        pool.submit(_start_worker)
+    return pool
+
+
 class PyMuPdfCleaner:
     def __init__(self,  pdf_path: str = None, mem_file: bytes = None,):
+        self.pdf_path = pdf_path
+        self.mem_file = mem_file
         if mem_file is None:
             self.document = fitz.open(pdf_path)
         else:
             self.document = fitz.open(stream=mem_file, filetype="pdf")
 
-    def extract_text_blocks(self) -> list[str]:
-        text_blocks = []
-
+    def iter_text_blocks(self) -> Iterator[str]:
+        """
+        Yield the text blocks of extract_text_blocks as every page is read, so the consumer can start before the
+        whole document is processed
+        """
         for page_num in range(self.document.page_count):
-            page = self.document[page_num]
-            blocks = page.get_text("blocks")
+            yield from _page_text_blocks(self.document[page_num])
 
-            for block in blocks:
-                if len(block[4].split(" ")) > 8:
-                    text = block[4].replace("\n", " ")
-                    text_blocks.append(text)
+    def extract_text_blocks(self, pool: ProcessPoolExecutor | None = None, workers: int = 1,
+                            min_pages_per_worker: int = 64) -> list[str]:
+        """
+        Get the text blocks with more than 8 words of every page
+        :param pool: processes of pdf_extraction_pool. Without it the pages are read in this process.
+        :param workers: number of processes of the pool used. With more than one, the pages are split in contiguous
+        ranges and every process opens its own copy of the document.
+        :param min_pages_per_worker: documents with fewer pages per worker use fewer processes. Opening the document
+        in a worker and sending the blocks back costs about as much as reading tens of pages.
+        :return text_blocks: blocks in page order
+        """
+        page_count = self.document.page_count
+        workers = min(workers, page_count // min_pages_per_worker)
+        if pool is None or workers <= 1:
+            return list(self.iter_text_blocks())
 
-        return text_blocks
+        pages_per_worker = -(-page_count // workers)
+        ranges = [(start, min(start + pages_per_worker, page_count))
+                  for start in range(0, page_count, pages_per_worker)]
+        futures = [pool.submit(_extract_page_range, self.pdf_path, self.mem_file, start, stop)
+                   for start, stop in ranges]
+        return [block for future in futures for page_blocks in future.result() for block in page_blocks]
 
     def get_metadata(self):
         return self.document.metadata
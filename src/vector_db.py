@@ -1,76 +1,424 @@
 import asyncio
+import hashlib
+import uuid
+from array import array
 
+import numpy as np
 from qdrant_client import AsyncQdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import (Distance, VectorParams, PointStruct, ScalarQuantization, ScalarQuantizationConfig,
+                                  ScalarType, ProductQuantization, ProductQuantizationConfig, CompressionRatio,
+                                  SearchParams, QuantizationSearchParams, HnswConfigDiff,
+                                  SearchRequest, NamedVector, ScoredPoint)
 import logging
 from embeddings_calculator import EmbeddingsCalculator
 from src.text_scraping import HtmlCleaner, PyMuPdfCleaner
 from src.question_generator import QuestionGeneratorTransformers
+from src.cache import LRUCache, text_digest
+from src.sparse_index import reciprocal_rank_fusion
+
+"""
+Storage profiles of a collection. Quantized profiles keep the compressed vectors in RAM and the original vectors on
+disk; searches run on the compressed vectors, fetching limit * oversampling candidates, and rescore them with the
+original vectors. Quantization is only applied by a Qdrant server, local storage ignores it.
+"""
+STORAGE_PROFILES = {
+    "full": {"quantization": None, "on_disk": False, "oversampling": None},
+    "int8": {"quantization": ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8,
+                                                                                quantile=0.99,
+                                                                                always_ram=True)),
+             "on_disk": True,
+             "oversampling": 2.0},
+    "pq": {"quantization": ProductQuantization(product=ProductQuantizationConfig(compression=CompressionRatio.X16,
+                                                                                 always_ram=True)),
+           "on_disk": True,
+           "oversampling": 4.0},
+}
+
+"""
+Index profiles. m and ef_construct set how the HNSW graph of a collection is built, hnsw_ef and exact set how a query
+explores it. "exact" skips the graph and compares the query with every vector.
+"""
+INDEX_PROFILES = {
+    "fast": {"m": 8, "ef_construct": 64, "hnsw_ef": 32, "exact": False},
+    "balanced": {"m": 16, "ef_construct": 100, "hnsw_ef": 128, "exact": False},
+    "exact": {"m": 16, "ef_construct": 100, "hnsw_ef": None, "exact": True},
+}
 
 
 class VectorDB:
-    def __init__(self):
-        self.client = AsyncQdrantClient(":memory:")
+    def __init__(self, storage: str = ":memory:", api_key: str | None = None, search_cache: LRUCache | None = None,
+                 upsert_batch_size: int = 256, upsert_parallel: int = 1):
+        """
+        :param storage: where the collections are kept. ":memory:" keeps them in memory and loses them on restart,
+        an http(s) URL connects to a Qdrant server and any other value is a local directory, which is reloaded
+        when the API restarts.
+        :param api_key: API key of the Qdrant server, only used with a URL.
+        :param search_cache: cache of search results
+        :param upsert_batch_size: maximum number of points sent in one upsert request
+        :param upsert_parallel: maximum number of upsert requests in flight at the same time
+        """
+        self.storage = storage
+        if storage == ":memory:":
+            self.client = AsyncQdrantClient(location=":memory:")
+        elif storage.startswith(("http://", "https://")):
+            self.client = AsyncQdrantClient(url=storage, api_key=api_key)
+        else:
+            self.client = AsyncQdrantClient(path=storage)
+        self.search_cache = search_cache if search_cache is not None else LRUCache(max_size=1024, ttl=300)
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_parallel = upsert_parallel
+        self._search_params: dict[str, SearchParams | None] = {}
+        self._vector_names: dict[str, list[str]] = {}
+
+    @staticmethod
+    def point_id(text_unit: str) -> str:
+        """
+        Deterministic point id of a text unit, so upserting the same unit again replaces its point.
+        """
+        return str(uuid.UUID(text_digest(text_unit)[:32]))
+
+    async def list_collections(self) -> list[str]:
+        response = await self.client.get_collections()
+        return [collection.name for collection in response.collections]
+
+    async def collection_exists(self, name: str) -> bool:
+        return name in await self.list_collections()
 
-    async def create_or_replace_collection(self, name: str, size: int = 384) -> None:
+    async def close(self) -> None:
+        await self.client.close()
+
+    def invalidate_collection(self, name: str) -> int:
+        """
+        Drop the cached search results of a collection. Called whenever its points change.
+        :param name: name of the collection
+        :return int: number of removed entries
+        """
+        return self.search_cache.invalidate(lambda key: key[0] == name)
+
+    @staticmethod
+    def _collection_config(size: int, profile: str, index_profile: str, vector_names: tuple | None) -> dict:
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile: {profile}")
+        if index_profile not in INDEX_PROFILES:
+            raise ValueError(f"Unknown index profile: {index_profile}")
+        vector_params = VectorParams(size=size, distance=Distance.COSINE, on_disk=STORAGE_PROFILES[profile]["on_disk"])
+        return {"vectors_config": {name: vector_params for name in vector_names} if vector_names else vector_params,
+                "hnsw_config": HnswConfigDiff(m=INDEX_PROFILES[index_profile]["m"],
+                                              ef_construct=INDEX_PROFILES[index_profile]["ef_construct"]),
+                "quantization_config": STORAGE_PROFILES[profile]["quantization"]}
+
+    async def get_search_params(self, name: str, index_profile: str | None = None) -> SearchParams | None:
+        """
+        Search parameters of a collection: rescoring and oversampling if it is quantized, plus the query parameters
+        of the index profile. The storage profile is read from the collection the first time it is searched.
+        :param name: name of the collection
+        :param index_profile: one of INDEX_PROFILES. None uses the defaults of the collection.
+        """
+        if name not in self._search_params:
+            info = await self.client.get_collection(collection_name=name)
+            vectors_config = info.config.params.vectors
+            self._vector_names[name] = sorted(vectors_config) if isinstance(vectors_config, dict) else []
+            quantization = info.config.quantization_config
+            if isinstance(quantization, ScalarQuantization):
+                oversampling = STORAGE_PROFILES["int8"]["oversampling"]
+            elif isinstance(quantization, ProductQuantization):
+                oversampling = STORAGE_PROFILES["pq"]["oversampling"]
+            else:
+                oversampling = None
+            self._search_params[name] = SearchParams(
+                quantization=QuantizationSearchParams(rescore=True, oversampling=oversampling)
+            ) if oversampling else None
+
+        params = self._search_params[name]
+        if index_profile is None:
+            return params
+        if index_profile not in INDEX_PROFILES:
+            raise ValueError(f"Unknown index profile: {index_profile}")
+        return SearchParams(hnsw_ef=INDEX_PROFILES[index_profile]["hnsw_ef"],
+                            exact=INDEX_PROFILES[index_profile]["exact"],
+                            quantization=params.quantization if params else None)
+
+    async def get_vector_names(self, name: str) -> list[str]:
+        """
+        Names of the vectors of a collection, or an empty list if its points have a single unnamed vector
+        """
+        if name not in self._vector_names:
+            self._search_params.pop(name, None)
+            await self.get_search_params(name)
+        return self._vector_names[name]
+
+    def _forget_collection(self, name: str) -> None:
+        self._search_params.pop(name, None)
+        self._vector_names.pop(name, None)
+        self.invalidate_collection(name)
+
+    async def create_or_replace_collection(self, name: str, size: int = 384, profile: str = "full",
+                                           index_profile: str = "balanced", vector_names: tuple | None = None) -> None:
         """
         Create or replace a collection in the QDrant client
         :param name: name of the collection
         :param size: size of the vectors. Depends on the model.
+        :param profile: storage profile, one of STORAGE_PROFILES: "full", "int8" or "pq".
+        :param index_profile: HNSW build parameters, one of INDEX_PROFILES: "fast", "balanced" or "exact".
+        :param vector_names: names of the vectors of every point. None for a single unnamed vector.
         :return:
         """
-        await self.client.recreate_collection(
-            collection_name=name,
-            vectors_config=VectorParams(size=size, distance=Distance.COSINE),
-        )
+        await self.client.recreate_collection(collection_name=name,
+                                              **self._collection_config(size, profile, index_profile, vector_names))
+        self._forget_collection(name)
 
-    async def create_collection(self, name: str, size: int = 384) -> None:
+    async def create_collection(self, name: str, size: int = 384, profile: str = "full",
+                                index_profile: str = "balanced", vector_names: tuple | None = None) -> None:
         """
         Create a collection in the QDrant client. If the collection already exists, it will raise a ValueError
         :param name: name of the collection
         :param size: size of the vectors. Depends on the model.
+        :param profile: storage profile, one of STORAGE_PROFILES: "full", "int8" or "pq".
+        :param index_profile: HNSW build parameters, one of INDEX_PROFILES: "fast", "balanced" or "exact".
+        :param vector_names: names of the vectors of every point. None for a single unnamed vector.
         :return:
         """
-        await self.client.create_collection(
-            collection_name=name,
-            vectors_config=VectorParams(size=size, distance=Distance.COSINE),
-        )
-
-    async def insert_into(self, name: str, lines_vectors: list[tuple]):
+        # the server backend does not raise ValueError on duplicates, so check it here for every backend
+        if await self.collection_exists(name):
+            raise ValueError(f"Collection {name} already exists")
+        await self.client.create_collection(collection_name=name,
+                                            **self._collection_config(size, profile, index_profile, vector_names))
+        self._forget_collection(name)
+
+    async def insert_into(self, name: str, lines_vectors: list[tuple], start_id: int = 0, ids: list | None = None,
+                          batch_size: int | None = None, parallel: int | None = None):
         """
-        Insert into a collection
+        Insert into a collection in batches of points. Zero vectors are skipped.
         :param name: name of a collection
         :param lines_vectors: pairs of lines and their embeddings
+        :param start_id: id of the first point. Used when a collection is filled in several chunks.
+        :param ids: explicit ids of the points, one per element of lines_vectors. Overrides start_id.
+        :param batch_size: points per upsert request. Defaults to the upsert_batch_size of the database.
+        :param parallel: upsert requests in flight at the same time. Defaults to the upsert_parallel of the database.
         :return:
         """
-        await self.client.upsert(
-            collection_name=name,
-            points=[
-                PointStruct(
-                    id=idx,
-                    vector=pair[1],
-                    payload={"question": pair[0], "answer": pair[2]}
-                )
-                for idx, pair in enumerate(lines_vectors) if all(element != 0.0 for element in pair[1])
-            ]
-        )
-
-    async def search_collection(self, name: str, query_vector: list, limit: int = 3):
-        """
-        Search in a collection
+        if not lines_vectors:
+            return
+        questions, vectors, answers = zip(*lines_vectors)
+        await self.insert_arrays(name, list(questions), np.asarray(vectors, dtype=np.float32), list(answers),
+                                 start_id=start_id, ids=ids, batch_size=batch_size, parallel=parallel)
+
+    async def insert_arrays(self, name: str, questions: list[str | None], vectors: np.ndarray | dict[str, np.ndarray],
+                            answers: list[str], start_id: int = 0, ids: list | None = None,
+                            batch_size: int | None = None, parallel: int | None = None):
+        """
+        Insert into a collection from a matrix of embeddings. Batches are built by at most parallel workers, each one
+        right before sending it, so rows are converted to Python floats for no more than parallel batches at a time.
+        Zero vectors are skipped.
+        :param name: name of a collection
+        :param questions: question of each point, None if the point only embeds its answer
+        :param vectors: matrix of embeddings, one row per point. Any float or integer dtype. For collections with
+        named vectors, a dictionary with one matrix per vector name.
+        :param answers: answer of each point
+        :param start_id: id of the first point. Used when a collection is filled in several chunks.
+        :param ids: explicit ids of the points, one per row. Overrides start_id.
+        :param batch_size: points per upsert request. Defaults to the upsert_batch_size of the database.
+        :param parallel: upsert requests in flight at the same time. Defaults to the upsert_parallel of the database.
+        :return:
+        """
+        if len(answers) == 0:
+            return
+        if ids is None:
+            ids = range(start_id, start_id + len(answers))
+        batch_size = batch_size or self.upsert_batch_size
+        matrices = vectors if isinstance(vectors, dict) else {None: vectors}
+        keep = np.flatnonzero(np.logical_and.reduce([np.any(matrix != 0, axis=1) for matrix in matrices.values()]))
+
+        async def upsert(positions: np.ndarray):
+            rows = {vector_name: matrix[positions].astype(np.float32, copy=False).tolist()
+                    for vector_name, matrix in matrices.items()}
+            if None in rows:
+                point_vectors = rows[None]
+            else:
+                point_vectors = [dict(zip(rows, named_rows)) for named_rows in zip(*rows.values())]
+            points = [PointStruct(id=ids[pos],
+                                  vector=vector,
+                                  payload={"question": questions[pos], "answer": answers[pos]})
+                      for pos, vector in zip(positions, point_vectors)]
+            await self.client.upsert(collection_name=name, points=points)
+
+        # shared by the workers, every batch is taken by the first free one
+        batch_starts = iter(range(0, len(keep), batch_size))
+
+        async def worker():
+            for start in batch_starts:
+                await upsert(keep[start:start + batch_size])
+
+        self.invalidate_collection(name)
+        num_workers = min(parallel or self.upsert_parallel, -(-len(keep) // batch_size))
+        await asyncio.gather(*(worker() for _ in range(num_workers)))
+        # searches issued during the upsert may have cached stale results
+        self.invalidate_collection(name)
+
+    async def search_collection(self, name: str, query_vector: list, limit: int = 3, index_profile: str | None = None):
+        """
+        Search in a collection. In collections with named vectors the query is compared with every vector of a
+        point and each point is scored by its best match.
         :param name: name of a collection
         :param query_vector: embedding of the desired query
         :param limit: number of returned hits
+        :param index_profile: query parameters, one of INDEX_PROFILES. None uses the defaults of the collection.
         :return hits: coincidences with the highest similarity
         """
-        return await self.client.search(collection_name=name,
-                                        query_vector=query_vector,
-                                        with_vectors=False,
+        key = (name, hashlib.sha1(array("d", query_vector).tobytes()).hexdigest(), limit, index_profile)
+        hits = self.search_cache.get(key)
+        if hits is None:
+            search_params = await self.get_search_params(name, index_profile)
+            vector_names = await self.get_vector_names(name)
+            if not vector_names:
+                hits = await self.client.search(collection_name=name,
+                                                query_vector=query_vector,
+                                                search_params=search_params,
+                                                with_vectors=False,
+                                                limit=limit)
+            else:
+                responses = await self.client.search_batch(
+                    collection_name=name,
+                    requests=[SearchRequest(vector=NamedVector(name=vector_name, vector=query_vector),
+                                            params=search_params,
+                                            with_vector=False,
+                                            with_payload=True,
+                                            limit=limit)
+                              for vector_name in vector_names])
+                hits = self._best_hits(responses, limit)
+            self.search_cache.put(key, hits)
+        return hits
+
+    @staticmethod
+    def _best_hits(responses: list[list], limit: int) -> list:
+        """
+        Merge the hits of the searches of one query in the named vectors of a collection, scoring each point by its
+        best match
+        """
+        best = {}
+        for hit in (hit for response in responses for hit in response):
+            if hit.id not in best or hit.score > best[hit.id].score:
+                best[hit.id] = hit
+        return sorted(best.values(), key=lambda hit: hit.score, reverse=True)[:limit]
+
+    async def search_collection_batch(self, name: str, query_vectors: list[list], limit: int = 3,
+                                      index_profile: str | None = None) -> list[list]:
+        """
+        Search several queries in a collection with one request. Cached queries are not sent again. In collections with
+        named vectors the request has one search per query and vector name, merged as in search_collection.
+        :param name: name of a collection
+        :param query_vectors: embeddings of the queries
+        :param limit: number of returned hits per query
+        :param index_profile: query parameters, one of INDEX_PROFILES. None uses the defaults of the collection.
+        :return hits: one list of hits per query, in the same order
+        """
+        keys = [(name, hashlib.sha1(array("d", vector).tobytes()).hexdigest(), limit, index_profile)
+                for vector in query_vectors]
+        results = [self.search_cache.get(key) for key in keys]
+        missing = [idx for idx, hits in enumerate(results) if hits is None]
+        if missing:
+            search_params = await self.get_search_params(name, index_profile)
+            vector_names = await self.get_vector_names(name)
+            responses = await self.client.search_batch(
+                collection_name=name,
+                requests=[SearchRequest(vector=NamedVector(name=vector_name, vector=query_vectors[idx])
+                                        if vector_name else query_vectors[idx],
+                                        params=search_params,
+                                        with_vector=False,
+                                        with_payload=True,
                                         limit=limit)
+                          for idx in missing for vector_name in vector_names or [None]])
+            searches_per_query = len(vector_names) or 1
+            for position, idx in enumerate(missing):
+                query_responses = responses[position * searches_per_query:(position + 1) * searches_per_query]
+                hits = self._best_hits(query_responses, limit) if vector_names else query_responses[0]
+                results[idx] = hits
+                self.search_cache.put(keys[idx], hits)
+        return results
+
+    async def retrieve_points(self, name: str, ids: list) -> list:
+        """
+        Points of a collection with their payloads, in the order of ids. Missing ids are skipped.
+        """
+        records = await self.client.retrieve(collection_name=name, ids=ids, with_payload=True, with_vectors=False)
+        by_id = {record.id: record for record in records}
+        return [by_id[point_id] for point_id in ids if point_id in by_id]
+
+    async def fuse_hits(self, name: str, dense_hits: list, ranking: list, limit: int = 3, k: int = 60) -> list:
+        """
+        Merge the hits of a dense search with another ranking of the same collection by reciprocal rank fusion
+        :param name: name of a collection
+        :param dense_hits: hits of search_collection, best first
+        :param ranking: ids of points, best first, for example the results of a sparse index
+        :param limit: number of returned hits
+        :param k: damping of the first ranks
+        :return hits: the best fused hits, with their fused score. Hits missing from the dense results are fetched.
+        """
+        fused = reciprocal_rank_fusion([[hit.id for hit in dense_hits], ranking], k)[:limit]
+        return await self.rescore_hits(name, fused, dense_hits)
+
+    async def rescore_hits(self, name: str, scores: list[tuple], known_hits: list) -> list:
+        """
+        Hits of a collection with new scores
+        :param name: name of a collection
+        :param scores: ids of points and their new scores, in the returned order
+        :param known_hits: hits already fetched, for example by search_collection. The other points are retrieved.
+        :return hits: copies of the hits with the new scores. Points that no longer exist are skipped.
+        """
+        hits = {hit.id: hit for hit in known_hits}
+        missing = [point_id for point_id, _ in scores if point_id not in hits]
+        if missing:
+            for record in await self.retrieve_points(name, missing):
+                hits[record.id] = ScoredPoint(id=record.id, version=0, score=0, payload=record.payload, vector=None)
+        # known hits may be shared with the search cache, copy them instead of changing their score
+        return [hits[point_id].model_copy(update={"score": score}) for point_id, score in scores if point_id in hits]
 
     async def count_collection(self, name: str):
         return await self.client.count(collection_name=name)
 
+    async def get_point_ids(self, name: str) -> set:
+        """
+        Ids of every point of a collection, without payloads nor vectors
+        """
+        ids = set()
+        offset = None
+        while True:
+            points, offset = await self.client.scroll(collection_name=name,
+                                                      limit=1000,
+                                                      offset=offset,
+                                                      with_payload=False,
+                                                      with_vectors=False)
+            ids.update(point.id for point in points)
+            if offset is None:
+                return ids
+
+    async def copy_points(self, source: str, target: str, ids: list, batch_size: int | None = None) -> None:
+        """
+        Copy points with their vectors and payloads from a collection to another one with the same vectors
+        :param source: name of the collection the points are read from
+        :param target: name of the collection the points are written to
+        :param ids: ids of the points. Missing ids are skipped.
+        :param batch_size: points per request. Defaults to the upsert_batch_size of the database.
+        """
+        batch_size = batch_size or self.upsert_batch_size
+        for start in range(0, len(ids), batch_size):
+            records = await self.client.retrieve(collection_name=source, ids=ids[start:start + batch_size],
+                                                 with_payload=True, with_vectors=True)
+            if records:
+                await self.client.upsert(collection_name=target,
+                                         points=[PointStruct(id=record.id, vector=record.vector,
+                                                             payload=record.payload)
+                                                 for record in records])
+        self.invalidate_collection(target)
+
+    async def delete_points(self, name: str, ids: list) -> None:
+        await self.client.delete(collection_name=name, points_selector=ids)
+        self.invalidate_collection(name)
+
+    async def delete_collection(self, name: str) -> None:
+        await self.client.delete_collection(collection_name=name)
+        self._forget_collection(name)
+
 
 async def html_test():
     logging.basicConfig(level=logging.DEBUG)
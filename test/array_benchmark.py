@@ -0,0 +1,54 @@
+"""
+Time and memory of EmbeddingsCalculator.calculate, which returns lists, against calculate_array in every dtype, on
+lines made of the text blocks of the test PDF:
+
+    python test/array_benchmark.py --lines 10000
+"""
+import argparse
+import sys
+import tracemalloc
+from pathlib import Path
+from time import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.embeddings_calculator import EmbeddingsCalculator  # noqa: E402
+from src.text_scraping import PyMuPdfCleaner  # noqa: E402
+
+TEST_DIR = Path(__file__).parent
+
+
+def array_benchmark(num_lines: int = 10_000):
+    cleaner = PyMuPdfCleaner(str(TEST_DIR / "attention-is-all-you-need.pdf"))
+    blocks = cleaner.extract_text_blocks()
+    cleaner.close_document()
+    lines = [blocks[idx % len(blocks)] + f" ({idx})" for idx in range(num_lines)]
+
+    emb_calc = EmbeddingsCalculator()
+    tracemalloc.start()
+    start = time()
+    embeddings = emb_calc.calculate(lines, use_cache=False)
+    elapsed = time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"list:    {elapsed:.2f} seconds, retained {current / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB")
+    del embeddings
+
+    for dtype in ("float32", "float16", "int8"):
+        emb_calc.dtype = dtype
+        tracemalloc.start()
+        start = time()
+        embeddings = emb_calc.calculate_array(lines)
+        elapsed = time() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{dtype + ':':<8} {elapsed:.2f} seconds, retained {current / 2 ** 20:.1f} MiB, "
+              f"peak {peak / 2 ** 20:.1f} MiB, matrix {embeddings.nbytes / 2 ** 20:.1f} MiB")
+        del embeddings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=10_000)
+    args = parser.parse_args()
+    array_benchmark(args.lines)
@@ -0,0 +1,46 @@
+"""
+Chunk the text units of the test PDF and of an HTML page with the tokenizer of the embedding model, and compare the
+token counts of the units and of the chunks:
+
+    python test/chunking_benchmark.py --max-tokens 128
+"""
+import argparse
+import sys
+from pathlib import Path
+from time import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.chunking import TextChunker  # noqa: E402
+from src.embeddings_calculator import EmbeddingsCalculator  # noqa: E402
+from src.text_scraping import HtmlCleaner, PyMuPdfCleaner  # noqa: E402
+
+TEST_DIR = Path(__file__).parent
+
+
+def chunking_benchmark(max_tokens: int = 128):
+    calculator = EmbeddingsCalculator()
+    chunker = TextChunker(calculator.load_tokenizer(), max_tokens=max_tokens)
+    cleaner = PyMuPdfCleaner(str(TEST_DIR / "attention-is-all-you-need.pdf"))
+    blocks = cleaner.extract_text_blocks()
+    cleaner.close_document()
+    with open(TEST_DIR / "html_from_api.html", "r") as f:
+        lines = HtmlCleaner(f.read(), streaming=True).extract_text_lines()
+
+    for name, units in (("pdf", blocks), ("html", lines)):
+        start = time()
+        chunks = chunker.chunk(units)
+        elapsed = time() - start
+        unit_tokens = chunker.count_tokens(units)
+        chunk_tokens = chunker.count_tokens(chunks)
+        truncated = sum(tokens > chunker.budget for tokens in unit_tokens)
+        print(f"{name}: {len(units)} units ({sum(unit_tokens) / len(units):.0f} tokens on average, {truncated} "
+              f"truncated by the model) -> {len(chunks)} chunks ({sum(chunk_tokens) / len(chunks):.0f} tokens on "
+              f"average, largest {max(chunk_tokens)}) in {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-tokens", type=int, default=128)
+    args = parser.parse_args()
+    chunking_benchmark(args.max_tokens)
@@ -0,0 +1,42 @@
+"""
+Throughput of QuestionGeneratorTransformers generating one question at a time and in batches of several sizes, on
+the text blocks of the test PDF:
+
+    python test/generation_benchmark.py --batch-sizes 8 16 32
+"""
+import argparse
+import sys
+from pathlib import Path
+from time import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.question_generator import QuestionGeneratorTransformers  # noqa: E402
+from src.text_scraping import PyMuPdfCleaner  # noqa: E402
+
+TEST_DIR = Path(__file__).parent
+
+
+def batch_benchmark(batch_sizes: list[int]):
+    generator = QuestionGeneratorTransformers()
+    cleaner = PyMuPdfCleaner(str(TEST_DIR / "attention-is-all-you-need.pdf"))
+    blocks = cleaner.extract_text_blocks()
+    cleaner.close_document()
+
+    start = time()
+    generator.generate_questions(blocks)
+    elapsed = time() - start
+    print(f"Sequential: {len(blocks) / elapsed:.2f} lines/sec ({elapsed:.2f} seconds)")
+
+    for batch_size in batch_sizes:
+        start = time()
+        generator.generate_questions_batched(blocks, batch_size=batch_size)
+        elapsed = time() - start
+        print(f"Batched (batch_size={batch_size}): {len(blocks) / elapsed:.2f} lines/sec ({elapsed:.2f} seconds)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32])
+    args = parser.parse_args()
+    batch_benchmark(args.batch_sizes)
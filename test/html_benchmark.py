@@ -0,0 +1,39 @@
+"""
+Time the BeautifulSoup and the streaming paths of HtmlCleaner on the HTML pages of this directory:
+
+    python test/html_benchmark.py --repeat 20
+"""
+import argparse
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.text_scraping import HtmlCleaner  # noqa: E402
+
+TEST_DIR = Path(__file__).parent
+
+
+def html_cleaner_benchmark(paths: list[Path], repeat: int) -> None:
+    for path in paths:
+        html_text = path.read_text()
+        reference = HtmlCleaner(html_text).extract_text_lines()
+        streamed = HtmlCleaner(html_text, streaming=True).extract_text_lines()
+        for streaming in (False, True):
+            start = perf_counter()
+            for _ in range(repeat):
+                HtmlCleaner(html_text, streaming=streaming).extract_text_lines()
+            elapsed = (perf_counter() - start) / repeat
+            print(f"{path.name} ({len(html_text) / 1024:.0f} KiB), {'streaming' if streaming else 'BeautifulSoup'}: "
+                  f"{elapsed * 1000:.1f} ms")
+        print(f"{len(reference)} lines, same output: {streamed == reference}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*", type=Path,
+                        default=[TEST_DIR / "html_from_api.html", TEST_DIR / "readability.html"])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    html_cleaner_benchmark(args.paths, args.repeat)
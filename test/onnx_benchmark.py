@@ -0,0 +1,67 @@
+"""
+Latency, throughput and drift from torch of the ONNX Runtime backend, with and without int8 quantization, for the
+embedding model and the question generator. It needs the packages listed in requirements_onnx.txt:
+
+    python test/onnx_benchmark.py --threads 4 --lines 256
+"""
+import argparse
+import sys
+from pathlib import Path
+from time import time
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.embeddings_calculator import EmbeddingsCalculator  # noqa: E402
+from src.question_generator import QuestionGeneratorTransformers  # noqa: E402
+from src.text_scraping import PyMuPdfCleaner  # noqa: E402
+
+TEST_DIR = Path(__file__).parent
+
+
+def onnx_benchmark(num_threads: int = 4, num_lines: int = 256):
+    cleaner = PyMuPdfCleaner(str(TEST_DIR / "attention-is-all-you-need.pdf"))
+    blocks = cleaner.extract_text_blocks()
+    cleaner.close_document()
+    lines = [blocks[idx % len(blocks)] for idx in range(num_lines)]
+    query = "What is an attention function?"
+
+    reference = None
+    for backend, quantize in (("torch", False), ("onnx", False), ("onnx", True)):
+        emb_calc = EmbeddingsCalculator(backend=backend, num_threads=num_threads, quantize=quantize)
+        emb_calc.calculate_array(lines[:8])
+        start = time()
+        for _ in range(20):
+            emb_calc.calculate(query, use_cache=False)
+        latency = (time() - start) / 20
+        start = time()
+        embeddings = emb_calc.calculate_array(lines)
+        throughput = len(lines) / (time() - start)
+        if reference is None:
+            reference = embeddings
+        cosine = np.sum(embeddings * reference, axis=1) / (np.linalg.norm(embeddings, axis=1)
+                                                          * np.linalg.norm(reference, axis=1))
+        print(f"embeddings {backend:>5} int8={quantize!s:5}: query {latency * 1000:6.1f} ms, "
+              f"{throughput:7.1f} lines/sec, max abs drift {np.abs(embeddings - reference).max():.4f}, "
+              f"min cosine {cosine.min():.4f}")
+
+    reference = None
+    for backend, quantize in (("torch", False), ("onnx", False), ("onnx", True)):
+        generator = QuestionGeneratorTransformers(backend=backend, num_threads=num_threads, quantize=quantize)
+        start = time()
+        questions = generator.generate_questions_batched(lines[:64])
+        throughput = 64 / (time() - start)
+        if reference is None:
+            reference = questions
+        same = sum(question == expected for question, expected in zip(questions, reference)) / len(reference)
+        print(f"generator  {backend:>5} int8={quantize!s:5}: {throughput:6.2f} lines/sec, "
+              f"{same:.1%} questions identical to torch")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=256)
+    args = parser.parse_args()
+    onnx_benchmark(args.threads, args.lines)
@@ -0,0 +1,52 @@
+"""
+Time PyMuPdfCleaner.extract_text_blocks read in the process against started pools of 2, 4 and 8 processes, on the
+test PDF and on documents made of copies of it:
+
+    python test/pdf_benchmark.py --copies 1 30 --repeat 5
+"""
+import argparse
+import sys
+from pathlib import Path
+from time import perf_counter
+
+import fitz
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.text_scraping import PyMuPdfCleaner, pdf_extraction_pool  # noqa: E402
+
+
+def parallel_pdf_benchmark(pdf_path: Path, copies: list[int], repeat: int) -> None:
+    source = fitz.open(pdf_path)
+    pools = {workers: pdf_extraction_pool(workers) for workers in (2, 4, 8)}
+    # wait for the processes of the pools to start, so they do not compete with the measures
+    warm_up = PyMuPdfCleaner(mem_file=source.tobytes())
+    for workers, pool in pools.items():
+        warm_up.extract_text_blocks(pool, workers, min_pages_per_worker=1)
+    warm_up.close_document()
+    for count in copies:
+        document = fitz.open()
+        for _ in range(count):
+            document.insert_pdf(source)
+        cleaner = PyMuPdfCleaner(mem_file=document.tobytes())
+        document.close()
+        reference = cleaner.extract_text_blocks()
+        for workers, pool in ((1, None), *pools.items()):
+            start = perf_counter()
+            for _ in range(repeat):
+                blocks = cleaner.extract_text_blocks(pool, workers, min_pages_per_worker=1)
+            print(f"{cleaner.document.page_count} pages, {workers} workers: "
+                  f"{(perf_counter() - start) / repeat:.3f} seconds, same output: {blocks == reference}")
+        cleaner.close_document()
+    for pool in pools.values():
+        pool.shutdown()
+    source.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", type=Path, default=Path(__file__).parent / "attention-is-all-you-need.pdf")
+    parser.add_argument("--copies", type=int, nargs="+", default=[1, 30])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    parallel_pdf_benchmark(args.pdf, args.copies, args.repeat)
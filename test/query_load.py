@@ -0,0 +1,70 @@
+"""
+Load test for /api/v1/query. Run it against a live server that already has the collection ingested:
+
+    python query_load.py --url http://localhost:8080 --collection-id <id>
+"""
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import requests
+
+QUERIES = [
+    "What is an attention function?",
+    "How many layers does the encoder have?",
+    "What is multi-head attention?",
+    "Why use self-attention?",
+]
+
+
+def get_token(base_url: str, username: str, password: str) -> str:
+    response = requests.post(f"{base_url}/api/v1/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def client(base_url: str, token: str, collection_id: str, num_requests: int) -> tuple[list[float], int]:
+    latencies = []
+    errors = 0
+    with requests.Session() as session:
+        session.headers["Authorization"] = f"Bearer {token}"
+        for i in range(num_requests):
+            params = {"collection_id": collection_id, "query": QUERIES[i % len(QUERIES)], "source_name": "load-test"}
+            start = perf_counter()
+            response = session.get(f"{base_url}/api/v1/query", params=params)
+            latencies.append(perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+    return latencies, errors
+
+
+def percentile(values: list[float], q: float) -> float:
+    return statistics.quantiles(values, n=100)[int(q) - 1] if len(values) > 1 else values[0]
+
+
+def run(base_url: str, token: str, collection_id: str, concurrency: int, num_requests: int) -> None:
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: client(base_url, token, collection_id, num_requests), range(concurrency)))
+    elapsed = perf_counter() - start
+    latencies = [latency for result in results for latency in result[0]]
+    errors = sum(result[1] for result in results)
+    print(f"clients={concurrency:3d} requests={len(latencies):5d} errors={errors:4d} "
+          f"p50={percentile(latencies, 50) * 1000:8.1f} ms p99={percentile(latencies, 99) * 1000:8.1f} ms "
+          f"throughput={len(latencies) / elapsed:7.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--collection-id", required=True)
+    parser.add_argument("--username", default="johndoe")
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    access_token = get_token(args.url, args.username, args.password)
+    for clients in args.clients:
+        run(args.url, access_token, args.collection_id, clients, args.requests)
@@ -0,0 +1,83 @@
+import numpy as np
+
+import src.cache
+from src.cache import LRUCache, UnitCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = LRUCache(max_size=2, ttl=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(src.cache, "monotonic", clock)
+    cache = LRUCache(max_size=10, ttl=5)
+    cache.put("a", 1)
+
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.1
+    assert cache.get("a", "missing") == "missing"
+    assert len(cache) == 0
+
+
+def test_peek_does_not_count_nor_refresh():
+    cache = LRUCache(max_size=2, ttl=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.peek("a") == 1
+    assert cache.peek("missing") is None
+    assert (cache.hits, cache.misses) == (0, 0)
+
+    # "a" was only peeked, so it is still the least recently used entry
+    cache.put("c", 3)
+    assert cache.peek("a") is None
+
+
+def test_stats_and_invalidate():
+    cache = LRUCache(max_size=10, ttl=None)
+    cache.put(("collection", 1), "hits")
+    cache.put(("other", 1), "hits")
+    cache.get(("collection", 1))
+    cache.get(("collection", 2))
+
+    assert cache.invalidate(lambda key: key[0] == "collection") == 1
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 1, 0.5)
+
+
+def test_zero_size_disables_the_cache():
+    cache = LRUCache(max_size=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_unit_cache_round_trip(tmp_path):
+    path = str(tmp_path / "units.sqlite")
+    cache = UnitCache(path)
+    vectors = np.arange(6, dtype=np.float32).reshape(2, 3)
+    cache.put_many("model", ["q1", "q2"], vectors, ["unit 1", "unit 2"])
+    cache.close()
+
+    found = UnitCache(path).get_many("model", ["unit 1", "unit 2", "unit 3"])
+    assert set(found) == {"unit 1", "unit 2"}
+    assert found["unit 2"][0] == "q2"
+    np.testing.assert_array_equal(found["unit 2"][1], vectors[1])
@@ -0,0 +1,59 @@
+from src.chunking import TextChunker, split_sentences
+
+
+class WordTokenizer:
+    """
+    One token per word, plus two special tokens, like the start and end tokens of the embedding model
+    """
+
+    def num_special_tokens_to_add(self) -> int:
+        return 2
+
+    def __call__(self, texts: list[str], add_special_tokens: bool = True) -> dict:
+        extra = [0, 0] if add_special_tokens else []
+        return {"input_ids": [list(range(len(text.split()))) + extra for text in texts]}
+
+
+def sentence(words: int, mark: str = "w") -> str:
+    return " ".join([mark] * words) + "."
+
+
+def test_split_sentences_keeps_closing_quotes():
+    assert split_sentences('He said "stop." Then (it ended.) Done?  Yes') == ['He said "stop."', "Then (it ended.)",
+                                                                            "Done?", "Yes"]
+    assert split_sentences("Version 1.5 is out. Next") == ["Version 1.5 is out.", "Next"]
+
+
+def test_chunks_fit_the_token_budget():
+    chunker = TextChunker(WordTokenizer(), max_tokens=20, overlap_tokens=6, min_tokens=4)
+    units = [" ".join(sentence(words) for words in (5, 7, 3, 9, 4)), sentence(40), sentence(2)]
+    chunks = chunker.chunk(units)
+    assert chunks
+    assert all(tokens <= chunker.budget for tokens in chunker.count_tokens(chunks))
+
+
+def test_short_units_are_merged_and_paragraphs_kept():
+    chunker = TextChunker(WordTokenizer(), max_tokens=22, overlap_tokens=0, min_tokens=8)
+    chunks = chunker.chunk([sentence(3, "a"), sentence(3, "b"), sentence(10, "c"), sentence(2, "d")])
+    # a alone is under min_tokens, so b joins it; every chunk then closes at the end of a unit
+    assert chunks == [f"{sentence(3, 'a')} {sentence(3, 'b')}", sentence(10, "c"), sentence(2, "d")]
+
+
+def test_split_units_overlap():
+    chunker = TextChunker(WordTokenizer(), max_tokens=12, overlap_tokens=4, min_tokens=1)
+    unit = " ".join([sentence(4, "a"), sentence(3, "b"), sentence(4, "c")])
+    chunks = chunker.chunk([unit])
+    assert chunks == [f"{sentence(4, 'a')} {sentence(3, 'b')}", f"{sentence(3, 'b')} {sentence(4, 'c')}"]
+
+
+def test_long_sentences_are_split_at_words():
+    chunker = TextChunker(WordTokenizer(), max_tokens=10, overlap_tokens=0)
+    chunks = chunker.chunk([sentence(25)])
+    assert [len(chunk.split()) for chunk in chunks] == [8, 8, 8, 1]
+    assert " ".join(chunks) == sentence(25)
+
+
+def test_empty_input():
+    chunker = TextChunker(WordTokenizer())
+    assert chunker.chunk([]) == []
+    assert chunker.chunk(["", "   "]) == []
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.fetching import FetchError, PageFetcher
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    body = b"<html><body><p>" + b"A paragraph of a stub article. " * 20 + b"</p></body></html>"
+
+    def do_GET(self):
+        if self.path == "/large":
+            self.send_response(200)
+            self.send_header("Content-Length", str(10 * 2 ** 20))
+            self.end_headers()
+            return
+        if self.path == "/missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def fetch_all(urls: list[str], **kwargs) -> tuple[list, dict]:
+    """
+    Fetch the urls one after the other with a new fetcher
+    :return: the result or the FetchError of every url, and the stats of the fetcher
+    """
+    async def run():
+        fetcher = PageFetcher(**kwargs)
+        results = []
+        for url in urls:
+            try:
+                results.append(await fetcher.fetch(url))
+            except FetchError as e:
+                results.append(e)
+        await fetcher.close()
+        return results, fetcher.stats()
+
+    return asyncio.run(run())
+
+
+def test_unchanged_pages_are_revalidated(base_url):
+    (first, second), stats = fetch_all([f"{base_url}/article"] * 2, parse=len)
+    assert first.status_code == 200 and not first.not_modified
+    assert second.status_code == 304 and second.not_modified
+    assert second.content == first.content == len(StubHandler.body)
+    assert (stats["requests"], stats["not_modified"]) == (2, 1)
+
+
+def test_oversized_and_failed_pages_raise(base_url):
+    (large, missing), _ = fetch_all([f"{base_url}/large", f"{base_url}/missing"], max_bytes=2 ** 20)
+    assert isinstance(large, FetchError) and "limit" in str(large)
+    assert isinstance(missing, FetchError) and "404" in str(missing)
@@ -0,0 +1,116 @@
+from src.ingestion import IngestionIndex, collection_key, content_digest
+
+
+def test_content_digest_depends_on_the_split():
+    assert content_digest(["ab", "c"]) != content_digest(["a", "bc"])
+    assert collection_key(["a"]) == content_digest(["a"])
+    assert collection_key(["a"], "direct-passage") != collection_key(["a"])
+
+
+def test_edit_then_revert_keeps_one_entry_per_source():
+    index = IngestionIndex()
+    index.start("old", "old", "/a", 2, "alice")
+    index.add_source("old", "/dup", "alice")
+    index.complete("old", 2)
+
+    # /a is edited: its new content gets its own collection and leaves the shared one on completion
+    index.start("new", "new", "/a", 3, "alice")
+    assert index.find_source("/a") == "old"
+    assert index.complete("new", 3) == []
+    assert index.user_collections("alice") == {"old": ["/dup"], "new": ["/a"]}
+
+    # /a is reverted: it joins the existing content and its edited content is left without sources
+    index.add_source("old", "/a", "alice")
+    dropped = index.release_source("old", "/a", "alice")
+    assert [entry["collection_id"] for entry in dropped] == ["new"]
+    assert index.get("new") is None
+    assert index.find_source("/a") == "old"
+    assert index.user_collections("alice") == {"old": ["/dup", "/a"]}
+
+
+def test_complete_replaces_the_previous_content():
+    index = IngestionIndex()
+    index.start("v1", "v1", "/a", 1, "alice")
+    index.complete("v1", 1)
+    index.start("v2", "v2", "/a", 1, "alice")
+    # the previous content stays searchable while the new one is ingested
+    assert index.user_collections("alice") == {"v1": ["/a"], "v2": ["/a"]}
+
+    dropped = index.complete("v2", 1)
+    assert [entry["collection_id"] for entry in dropped] == ["v1"]
+    assert index.user_collections("alice") == {"v2": ["/a"]}
+
+
+def test_failed_update_keeps_the_previous_content():
+    index = IngestionIndex()
+    index.start("v1", "v1", "/a", 1, "alice")
+    index.complete("v1", 1)
+    index.start("v2", "v2", "/a", 1, "alice")
+    index.remove("v2")
+    assert index.find_source("/a") == "v1"
+    assert index.get("v1")["status"] == "ready"
+
+
+def test_release_keeps_sources_of_other_users_and_strategies():
+    index = IngestionIndex()
+    index.start("v1", "v1", "/a", 1, "alice")
+    index.add_source("v1", "/a", "bob")
+    index.complete("v1", 1)
+    index.start("passages", "passages", "/a", 1, "alice", strategy="direct-passage")
+    index.complete("passages", 1)
+    index.start("v2", "v2", "/a", 1, "alice")
+
+    assert index.complete("v2", 1) == []
+    assert index.get("v1")["owners"] == {"bob": ["/a"]}
+    assert index.get("passages")["sources"] == ["/a"]
+
+
+def test_ingesting_entries_are_not_dropped():
+    index = IngestionIndex()
+    index.start("v1", "v1", "/a", 1, "alice")
+    index.start("v2", "v2", "/a", 1, "alice")
+    assert index.complete("v2", 1) == []
+    assert index.get("v1")["sources"] == []
+
+
+def test_collection_in_use():
+    index = IngestionIndex()
+    index.start("digest", "collection", "/a", 1, "alice")
+    assert index.collection_in_use("collection")
+    assert not index.collection_in_use("digest")
+
+
+def test_persisted_index_discards_interrupted_ingestions(tmp_path):
+    path = tmp_path / "index.json"
+    index = IngestionIndex(str(path))
+    index.start("ready", "ready", "/a", 1, "alice")
+    index.complete("ready", 1)
+    index.start("interrupted", "interrupted", "/b", 1, "alice")
+
+    assert set(IngestionIndex(str(path)).entries) == {"ready"}
+
+
+def test_same_content_is_shared_between_sources_and_users():
+    index = IngestionIndex()
+    index.start("digest", "digest", "/a", 2, "alice")
+    index.add_source("digest", "/b", "alice")
+    index.add_source("digest", "/a", "bob")
+    index.add_source("digest", "/a", "bob")
+
+    entry = index.get("digest")
+    assert entry["sources"] == ["/a", "/b"]
+    assert entry["owners"] == {"alice": ["/a", "/b"], "bob": ["/a"]}
+    assert index.find_source("/b") == "digest"
+    assert index.find_source("/b", strategy="direct-passage") is None
+
+
+def test_user_collections_only_list_the_sources_of_the_user():
+    index = IngestionIndex()
+    index.start("paper", "paper", "alice/paper.pdf", 1, "alice")
+    index.start("article", "article", "/article", 1, "alice")
+    index.add_source("article", "/article", "bob")
+    index.add_source("article", "/copy", "bob")
+
+    assert index.user_collections("alice") == {"paper": ["alice/paper.pdf"], "article": ["/article"]}
+    assert index.user_collections("bob") == {"article": ["/article", "/copy"]}
+    assert index.user_collections("carol") == {}
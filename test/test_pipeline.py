@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from src.pipeline import run_stages
+
+
+def test_items_flow_through_the_stages_in_order():
+    results = []
+
+    async def double(item):
+        return item * 2
+
+    async def collect(item):
+        results.append(item)
+
+    asyncio.run(run_stages(range(10), double, collect, max_queue_size=1))
+    assert results == [item * 2 for item in range(10)]
+
+
+def test_stages_overlap():
+    events = []
+
+    async def first(item):
+        events.append(("first", item))
+        await asyncio.sleep(0.01)
+        return item
+
+    async def second(item):
+        events.append(("second", item))
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run_stages(range(3), first, second))
+    # the first stage starts the next item before the second stage finishes the previous one
+    assert events.index(("first", 1)) < events.index(("second", 1))
+
+
+def test_error_propagates_and_cancels_the_other_stages():
+    processed = []
+    cancelled = asyncio.Event()
+
+    async def fail_on_three(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+    async def slow_sink(item):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        processed.append(item)
+
+    async def run():
+        with pytest.raises(ValueError, match="bad item"):
+            await asyncio.wait_for(run_stages(range(100), fail_on_three, slow_sink, max_queue_size=2), 5)
+        assert cancelled.is_set()
+
+    asyncio.run(run())
+    assert processed == []
+
+
+def test_error_while_feeding_propagates():
+    def items():
+        yield 1
+        raise RuntimeError("source failed")
+
+    async def sink(item):
+        pass
+
+    with pytest.raises(RuntimeError, match="source failed"):
+        asyncio.run(run_stages(items(), sink))
@@ -0,0 +1,62 @@
+import pytest
+
+from src.sparse_index import BM25Index, SparseIndexStore, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_keeps_model_names_and_numbers():
+    assert tokenize("GPT-3.5 beats t5-base by 1.5e-4, really.") == ["gpt-3.5", "beats", "t5-base", "by", "1.5e-4",
+                                                                     "really"]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+    assert [item for item, _ in fused] == ["a", "c", "b"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[2][1] == pytest.approx(1 / 62)
+
+
+def test_bm25_ranks_rare_terms_first():
+    index = BM25Index()
+    index.add(["1", "2", "3"], ["the encoder has six layers",
+                                "the decoder has six layers",
+                                "the attention function maps a query"])
+    hits = index.search("encoder layers")
+    assert [point_id for point_id, _ in hits] == ["1", "2"]
+    assert hits[0][1] > hits[1][1]
+    assert index.search("unknown words") == []
+
+
+def test_bm25_add_is_idempotent_and_remove_updates_the_statistics():
+    index = BM25Index()
+    index.add(["1", "2"], ["alpha beta", "beta gamma delta"])
+    index.add(["1"], ["alpha beta"])
+    assert len(index) == 2
+    assert index.total_length == 5
+
+    index.remove(["2", "missing"])
+    assert len(index) == 1
+    assert index.total_length == 2
+    assert "gamma" not in index.postings
+    assert [point_id for point_id, _ in index.search("beta")] == ["1"]
+
+
+def test_bm25_round_trip():
+    index = BM25Index(k1=1.5, b=0.5)
+    index.add(["1", "2"], ["alpha beta", "beta gamma"])
+    restored = BM25Index.from_dict(index.to_dict())
+    assert (restored.k1, restored.b, restored.total_length) == (1.5, 0.5, 4)
+    assert restored.search("gamma beta") == index.search("gamma beta")
+
+
+def test_store_only_searches_collections_with_an_index(tmp_path):
+    store = SparseIndexStore(str(tmp_path))
+    assert store.search("legacy", "query") is None
+
+    store.create("collection")
+    store.add("collection", ["1"], ["multi-head attention"])
+    store.save("collection")
+
+    reloaded = SparseIndexStore(str(tmp_path))
+    assert [point_id for point_id, _ in reloaded.search("collection", "attention")] == ["1"]
+    reloaded.delete("collection")
+    assert reloaded.search("collection", "attention") is None
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import pytest
+
+from src.text_scraping import HtmlCleaner
+
+TEST_DIR = Path(__file__).parent
+
+"""
+Markup where parsers build different trees: block elements inside paragraphs, stray and missing end tags, void and
+self-closing elements, character references, comments and CDATA
+"""
+HTML_PARITY_CASES = (
+    "<p>a<div>b</div>c</p>",
+    "<p>x<table><tr><td>cell</td></tr></table>y</p>",
+    "<p>one<p>two</p>three</p>",
+    "<ul><li>a<ul><li>b</li></ul></li></ul><blockquote><p>q</p> tail</blockquote>",
+    "<p>a<h2>title</h2>b<nav>menu<p>hidden</p></nav>c</p>",
+    "<title><p>Title</p></title><p>body</p>",
+    "<p>open <b>bold <i>both</b> after</i></p></div></p>",
+    "<p>line<br>break<br/>again</br><img src='x'>after</img></p>",
+    "<p>&amp; &lt;tag&gt; &nbsp;&copy; &#233; &#x41; &#150; &unknown; &amp</p>",
+    "<p>text<!-- comment -->more <![CDATA[raw]]></p>",
+    "<pre>  keep\n   spaces  </pre><p>  </p><p>\n\n</p><ol>\n  <li> item </li>\n</ol>",
+    "<p><script>var p = '<p>';</script>after script</p><style>p {}</style>",
+)
+
+
+@pytest.mark.parametrize("html", HTML_PARITY_CASES)
+def test_streaming_cleaner_matches_beautifulsoup(html):
+    assert HtmlCleaner(html, streaming=True).extract_text_lines() == HtmlCleaner(html).extract_text_lines()
+
+
+@pytest.mark.parametrize("file_name", ["html_from_api.html", "readability.html"])
+def test_streaming_cleaner_matches_beautifulsoup_on_pages(file_name):
+    html = (TEST_DIR / file_name).read_text()
+    reference = HtmlCleaner(html).extract_text_lines()
+    assert reference
+    assert HtmlCleaner(html, streaming=True).extract_text_lines() == reference
+
+
+def test_lines_do_not_depend_on_how_the_html_is_fed():
+    html = (TEST_DIR / "readability.html").read_text()
+    cleaner = HtmlCleaner(html, streaming=True)
+    assert list(cleaner.iter_text_lines(chunk_size=7)) == cleaner.extract_text_lines()
+
+
+def test_stop_elements_are_skipped():
+    html = "<header><p>menu</p></header><p>kept</p><footer><ul><li>links</li></ul></footer><ol><li>item</li></ol>"
+    assert HtmlCleaner(html, streaming=True).extract_text_lines() == ["kept", "item"]
@@ -0,0 +1,285 @@
+"""
+Benchmarks of VectorDB. quantization and hnsw need a Qdrant server, the others use local storage:
+
+    python test/vector_benchmarks.py hnsw --url http://localhost:6333
+"""
+import argparse
+import asyncio
+import shutil
+import sys
+import tempfile
+from inspect import signature
+from pathlib import Path
+from time import time
+
+import numpy as np
+from qdrant_client.models import CollectionStatus, PointStruct, SearchParams
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.cache import LRUCache  # noqa: E402
+from src.embeddings_calculator import EmbeddingsCalculator  # noqa: E402
+from src.question_generator import QuestionGeneratorTransformers  # noqa: E402
+from src.sparse_index import BM25Index, tokenize  # noqa: E402
+from src.text_scraping import HtmlCleaner, PyMuPdfCleaner  # noqa: E402
+from src.vector_db import VectorDB, STORAGE_PROFILES, INDEX_PROFILES  # noqa: E402
+
+TEST_DIR = Path(__file__).parent
+
+
+async def warm_restart_benchmark(sizes: tuple = (1_000, 10_000, 100_000), dim: int = 384):
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        path = tempfile.mkdtemp(prefix="qdrant_bench_")
+        try:
+            db = VectorDB(storage=path)
+            await db.create_collection("bench", dim)
+            for start_id in range(0, size, 1000):
+                vectors = rng.standard_normal((min(1000, size - start_id), dim), dtype=np.float32)
+                await db.insert_into("bench", [("q", vector.tolist(), "a") for vector in vectors], start_id=start_id)
+            await db.close()
+
+            start = time()
+            db = VectorDB(storage=path)
+            collections = await db.list_collections()
+            count = await db.count_collection("bench")
+            elapsed = time() - start
+            await db.close()
+            print(f"{size:>8} vectors: warm restart in {elapsed:.2f} seconds "
+                  f"({len(collections)} collection, {count.count} points reloaded)")
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+async def insert_benchmark(sizes: tuple = (10_000, 100_000), dim: int = 384):
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        vectors = rng.standard_normal((size, dim), dtype=np.float32)
+        lines_vectors = [(f"question {idx}", vector.tolist(), f"answer {idx}") for idx, vector in enumerate(vectors)]
+
+        db = VectorDB()
+        await db.create_collection("bench", dim)
+        start = time()
+        # previous implementation: one upsert with a pure Python zero check of every element
+        await db.client.upsert(
+            collection_name="bench",
+            points=[PointStruct(id=idx, vector=pair[1], payload={"question": pair[0], "answer": pair[2]})
+                    for idx, pair in enumerate(lines_vectors) if all(element != 0.0 for element in pair[1])])
+        print(f"{size:>7} points, single upsert: {time() - start:.2f} seconds")
+
+        for batch_size, parallel in ((256, 1), (1024, 1), (256, 4)):
+            await db.create_or_replace_collection("bench", dim)
+            start = time()
+            await db.insert_into("bench", lines_vectors, batch_size=batch_size, parallel=parallel)
+            print(f"{size:>7} points, batch_size={batch_size} parallel={parallel}: {time() - start:.2f} seconds")
+        await db.close()
+
+
+async def quantization_benchmark(url: str = "http://localhost:6333", limit: int = 10):
+    """
+    Recall@limit and estimated RAM of every storage profile, using the text units of the test documents as both
+    the corpus and the queries. It needs a Qdrant server because local storage does not quantize.
+    """
+    emb_calc = EmbeddingsCalculator()
+    with open(TEST_DIR / "readability.html") as f:
+        lines = HtmlCleaner(f.read()).extract_text_lines()
+    cleaner = PyMuPdfCleaner(str(TEST_DIR / "attention-is-all-you-need.pdf"))
+    units = lines + cleaner.extract_text_blocks()
+    cleaner.close_document()
+    vectors = emb_calc.calculate_array(units)
+    queries = vectors[::5]
+
+    db = VectorDB(storage=url, search_cache=LRUCache(max_size=0))
+    await db.create_or_replace_collection("bench_full", vectors.shape[1])
+    await db.insert_arrays("bench_full", units, vectors, units)
+    exact = [{hit.id for hit in await db.client.search(collection_name="bench_full",
+                                                       query_vector=query.tolist(),
+                                                       search_params=SearchParams(exact=True),
+                                                       limit=limit)}
+             for query in queries]
+
+    bytes_per_vector = {"full": vectors.shape[1] * 4, "int8": vectors.shape[1], "pq": vectors.shape[1] * 4 / 16}
+    for profile in STORAGE_PROFILES:
+        name = f"bench_{profile}"
+        await db.create_or_replace_collection(name, vectors.shape[1], profile=profile)
+        await db.insert_arrays(name, units, vectors, units)
+        start = time()
+        found = [{hit.id for hit in await db.search_collection(name, query.tolist(), limit=limit)} for query in queries]
+        elapsed = time() - start
+        recall = np.mean([len(hits & truth) / len(truth) for hits, truth in zip(found, exact)])
+        print(f"{profile:>5}: recall@{limit} {recall:.3f}, "
+              f"RAM ~{len(units) * bytes_per_vector[profile] / 2 ** 10:.0f} KiB for {len(units)} vectors, "
+              f"{len(queries) / elapsed:.0f} queries/sec")
+        await db.delete_collection(name)
+    await db.delete_collection("bench_full")
+    await db.close()
+
+
+async def hnsw_benchmark(url: str = "http://localhost:6333", sizes: tuple = (1_000, 10_000, 100_000, 1_000_000),
+                         dim: int = 384, num_queries: int = 100, limit: int = 10):
+    """
+    Build time, estimated memory, queries/sec and recall@limit of every index profile over random vectors. It needs
+    a Qdrant server because local storage always searches exhaustively.
+    """
+    rng = np.random.default_rng(0)
+    db = VectorDB(storage=url, search_cache=LRUCache(max_size=0))
+    queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+    for size in sizes:
+        truth = None
+        for profile in ("exact", "balanced", "fast"):
+            name = f"bench_hnsw_{profile}"
+            await db.create_or_replace_collection(name, dim, index_profile=profile)
+            start = time()
+            chunk_rng = np.random.default_rng(size)
+            for start_id in range(0, size, 10_000):
+                vectors = chunk_rng.standard_normal((min(10_000, size - start_id), dim), dtype=np.float32)
+                await db.insert_arrays(name, [""] * len(vectors), vectors, [""] * len(vectors), start_id=start_id)
+            # the server builds the index in the background
+            while (await db.client.get_collection(collection_name=name)).status != CollectionStatus.GREEN:
+                await asyncio.sleep(0.5)
+            build_time = time() - start
+
+            start = time()
+            found = [[hit.id for hit in await db.search_collection(name, query.tolist(), limit, profile)]
+                     for query in queries]
+            qps = num_queries / (time() - start)
+            if truth is None:
+                truth = found
+            recall = np.mean([len(set(hits) & set(exact)) / limit for hits, exact in zip(found, truth)])
+            memory = size * (dim * 4 + INDEX_PROFILES[profile]["m"] * 2 * 8)
+            print(f"{size:>9} vectors, {profile:>8}: build {build_time:7.2f} s, ~{memory / 2 ** 20:8.1f} MiB, "
+                  f"{qps:8.1f} queries/sec, recall@{limit} {recall:.3f}")
+            await db.delete_collection(name)
+    await db.close()
+
+
+async def indexing_benchmark(limit: int = 3, sample_every: int = 10):
+    """
+    Ingestion time and retrieval quality of the indexing strategies on the test documents. Two query sets are
+    built from every sample_every-th unit: a question written by the generator with a different instruction, and
+    the second half of the unit. A query is answered if its unit is among the first limit hits.
+    """
+    emb_calc = EmbeddingsCalculator()
+    question_generator = QuestionGeneratorTransformers()
+    with open(TEST_DIR / "readability.html") as f:
+        html_lines = HtmlCleaner(f.read()).extract_text_lines()
+    cleaner = PyMuPdfCleaner(str(TEST_DIR / "attention-is-all-you-need.pdf"))
+    documents = {"readability.html": html_lines, "attention-is-all-you-need.pdf": cleaner.extract_text_blocks()}
+    cleaner.close_document()
+
+    for document, units in documents.items():
+        units = list(dict.fromkeys(unit for unit in units if len(unit.split()) > 3))
+        sample = units[::sample_every]
+        instruction = question_generator.instruction
+        question_generator.instruction = "Write a question that a reader of the following text could ask:\n\n"
+        query_sets = {"questions": question_generator.generate_questions_batched(sample),
+                      "fragments": [" ".join(unit.split()[len(unit.split()) // 2:]) for unit in sample]}
+        question_generator.instruction = instruction
+
+        db = VectorDB(search_cache=LRUCache(max_size=0))
+        for strategy, vector_names in (("generated-question", ("question",)),
+                                       ("direct-passage", ("passage",)),
+                                       ("hybrid", ("question", "passage"))):
+            start = time()
+            vectors = {}
+            questions = [None] * len(units)
+            if "question" in vector_names:
+                questions = question_generator.generate_questions_batched(units)
+                vectors["question"] = emb_calc.calculate_array(questions)
+            if "passage" in vector_names:
+                vectors["passage"] = emb_calc.calculate_array(units)
+            await db.create_or_replace_collection("bench", vector_names=vector_names if len(vector_names) > 1 else None)
+            await db.insert_arrays("bench", questions, vectors if len(vectors) > 1 else vectors[vector_names[0]], units)
+            ingestion_time = time() - start
+
+            results = []
+            for query_set, queries in query_sets.items():
+                query_vectors = emb_calc.calculate_array(queries)
+                ranks = []
+                for unit, query_vector in zip(sample, query_vectors):
+                    hits = await db.search_collection("bench", query_vector.tolist(), limit)
+                    answers = [hit.payload["answer"] for hit in hits]
+                    ranks.append(answers.index(unit) + 1 if unit in answers else None)
+                recall = sum(rank is not None for rank in ranks) / len(ranks)
+                mrr = sum(1 / rank for rank in ranks if rank) / len(ranks)
+                results.append(f"{query_set} recall@{limit} {recall:.3f} MRR {mrr:.3f}")
+            print(f"{document} ({len(units)} units), {strategy:>18}: ingestion {ingestion_time:7.2f} s, "
+                  + ", ".join(results))
+        await db.close()
+
+
+async def hybrid_benchmark(limit: int = 3, sample_every: int = 5, candidates: int = 20):
+    """
+    Ingestion cost and query latency of dense search against dense search fused with BM25, on the passages of the
+    test documents. Two query sets are built from every sample_every-th unit: its second half, and keywords made of
+    its two rarest terms, such as names, acronyms and numbers. A query is answered if its unit is among the first
+    limit hits.
+    """
+    emb_calc = EmbeddingsCalculator()
+    with open(TEST_DIR / "readability.html") as f:
+        html_lines = HtmlCleaner(f.read(), streaming=True).extract_text_lines()
+    cleaner = PyMuPdfCleaner(str(TEST_DIR / "attention-is-all-you-need.pdf"))
+    documents = {"readability.html": html_lines, "attention-is-all-you-need.pdf": cleaner.extract_text_blocks()}
+    cleaner.close_document()
+
+    for document, units in documents.items():
+        units = list(dict.fromkeys(unit for unit in units if len(unit.split()) > 3))
+        ids = [VectorDB.point_id(unit) for unit in units]
+        db = VectorDB(search_cache=LRUCache(max_size=0))
+        start = time()
+        await db.create_or_replace_collection("bench")
+        await db.insert_arrays("bench", [None] * len(units), emb_calc.calculate_array(units), units, ids=ids)
+        dense_time = time() - start
+        start = time()
+        index = BM25Index()
+        index.add(ids, units)
+        sparse_time = time() - start
+        print(f"{document} ({len(units)} units): dense ingestion {dense_time:.2f} s, BM25 index {sparse_time:.3f} s")
+
+        sample = units[::sample_every]
+        frequencies = {term: len(postings) for term, postings in index.postings.items()}
+        query_sets = {"fragments": [" ".join(unit.split()[len(unit.split()) // 2:]) for unit in sample],
+                      "keywords": [" ".join(sorted(set(tokenize(unit)), key=lambda term: frequencies[term])[:2])
+                                   for unit in sample]}
+        for query_set, queries in query_sets.items():
+            query_vectors = emb_calc.calculate_array(queries)
+            for mode in ("dense", "hybrid"):
+                ranks, latencies = [], []
+                for unit, query, query_vector in zip(sample, queries, query_vectors):
+                    start = time()
+                    if mode == "dense":
+                        hits = await db.search_collection("bench", query_vector.tolist(), limit)
+                    else:
+                        dense_hits = await db.search_collection("bench", query_vector.tolist(), candidates)
+                        ranking = [point_id for point_id, _ in index.search(query, candidates)]
+                        hits = await db.fuse_hits("bench", dense_hits, ranking, limit)
+                    latencies.append(time() - start)
+                    answers = [hit.payload["answer"] for hit in hits]
+                    ranks.append(answers.index(unit) + 1 if unit in answers else None)
+                recall = sum(rank is not None for rank in ranks) / len(ranks)
+                mrr = sum(1 / rank for rank in ranks if rank) / len(ranks)
+                latencies.sort()
+                print(f"  {query_set:>9} {mode:>6}: recall@{limit} {recall:.3f} MRR {mrr:.3f}, "
+                      f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+                      f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+        await db.close()
+
+
+BENCHMARKS = {
+    "warm-restart": warm_restart_benchmark,
+    "insert": insert_benchmark,
+    "quantization": quantization_benchmark,
+    "hnsw": hnsw_benchmark,
+    "indexing": indexing_benchmark,
+    "hybrid": hybrid_benchmark,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--url", help="Qdrant server of the benchmarks that need one")
+    args = parser.parse_args()
+    benchmark = BENCHMARKS[args.benchmark]
+    kwargs = {"url": args.url} if args.url and "url" in signature(benchmark).parameters else {}
+    asyncio.run(benchmark(**kwargs))
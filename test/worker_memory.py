@@ -0,0 +1,43 @@
+"""
+Memory of the API processes. Run it on the same host as the server, passing the pid of the gunicorn master
+(or of a single uvicorn process):
+
+    python worker_memory.py --pid <pid>
+
+RSS counts shared pages in every process, PSS splits them between the processes that share them and USS only
+counts pages private to the process, which is what each additional worker really costs.
+"""
+import argparse
+from pathlib import Path
+
+
+def memory(pid: int) -> dict:
+    values = {}
+    for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines()[1:]:
+        key, value = line.split(":", 1)
+        values[key] = int(value.split()[0])
+    return {"rss": values["Rss"],
+            "pss": values["Pss"],
+            "uss": values["Private_Clean"] + values["Private_Dirty"]}
+
+
+def children(pid: int) -> list[int]:
+    pids = []
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        pids.extend(int(child) for child in (task / "children").read_text().split())
+    return pids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pid", type=int, required=True)
+    args = parser.parse_args()
+
+    processes = [("master", args.pid)] + [("worker", pid) for pid in children(args.pid)]
+    total_pss = 0
+    for role, pid in processes:
+        usage = memory(pid)
+        total_pss += usage["pss"]
+        print(f"{role:>6} {pid:>7}: RSS {usage['rss'] / 1024:8.1f} MiB, PSS {usage['pss'] / 1024:8.1f} MiB, "
+              f"USS {usage['uss'] / 1024:8.1f} MiB")
+    print(f"total PSS {total_pss / 1024:.1f} MiB for {len(processes) - 1} workers")